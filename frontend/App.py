@@ -4,6 +4,7 @@ import json
 import logging
 import sys
 import threading
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger(__name__)
@@ -11,7 +12,7 @@ logger = logging.getLogger(__name__)
 from pathlib import Path
 from AppConfig import AppConfig
 from CustomVideoOutput import CustomVideoOutput
-from HeatmapProvider import HeatmapOverlayProvider
+from HeatmapProvider import HeatmapOverlayProvider, PointsOverlayProvider
 from NotesModel import NotesModel
 from PyQt6.QtGui import QSurfaceFormat
 from PyQt6.QtQml import QQmlApplicationEngine, qmlRegisterType
@@ -84,7 +85,8 @@ if __name__ == '__main__':
     SubjectMultimodalData.fill_missing_datatype(dialogue_line)
 
     manifest_model = AppConfig(manifest, user_config, event_subtypes)
-    segment_model = SegmentModel(segments, dialogue_line, manifest_model, video_src=manifest['sources']['videos'])
+    proxy_src = manifest.get('artifacts', {}).get('proxy_video', {})
+    segment_model = SegmentModel(segments, dialogue_line, manifest_model, video_src=manifest['sources']['videos'], proxy_src=proxy_src)
     segment_model.AdjustFilter(manifest_model.SegmentMinDurSec(), manifest_model.SegmentDisplayDurSec())
 
     qf = QSurfaceFormat()
@@ -109,14 +111,19 @@ if __name__ == '__main__':
 
     if 'video_overlay' in manifest['artifacts']:
         for vo in manifest['artifacts']['video_overlay']:
-            path = Path(manifest['artifacts']['video_overlay'][vo]['path'])
+            overlay = manifest['artifacts']['video_overlay'][vo]
+            path = Path(overlay['path'])
             if not path.is_file():
                 continue
 
             logger.info('Processing video overlay %s ...', path)
-            heatmap_info = pd.read_csv(path)
-            heatmap_info['filename'] = heatmap_info['filename'].apply(lambda x: path.parent / x)
-            heatmap_overlay_provider = HeatmapOverlayProvider(heatmap_info, cmap=user_config['video_overlay'][vo]['colormap'])
+            if overlay.get('type') == 'points':
+                with np.load(path) as points:
+                    heatmap_overlay_provider = PointsOverlayProvider(dict(points), cmap=user_config['video_overlay'][vo]['colormap'])
+            else:
+                heatmap_info = pd.read_csv(path)
+                heatmap_info['filename'] = heatmap_info['filename'].apply(lambda x: path.parent / x)
+                heatmap_overlay_provider = HeatmapOverlayProvider(heatmap_info, cmap=user_config['video_overlay'][vo]['colormap'])
             overlay_root = segment_model.add_video_overlay_provider(vo, heatmap_overlay_provider)
             engine.addImageProvider(overlay_root, heatmap_overlay_provider)
 
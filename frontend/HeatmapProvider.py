@@ -2,6 +2,9 @@ import numpy as np
 import logging
 import colorcet as cc
 
+from collections import OrderedDict
+from pathlib import Path
+from scipy.signal import fftconvolve
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QImage
 from PyQt6.QtQuick import QQuickImageProvider
@@ -51,10 +54,63 @@ def create_heatmap_img(heatmap, colormap=None):
     return heatmap_img
 
 
+class ArrayCache:
+    # Keeps the most recently used arrays up to max_bytes
+    def __init__(self, max_bytes=256 << 20):
+        self.max_bytes = max_bytes
+        self.arrays = OrderedDict()
+        self.num_bytes = 0
+
+    def get(self, key):
+        if key not in self.arrays:
+            return None
+        self.arrays.move_to_end(key)
+        return self.arrays[key]
+
+    def put(self, key, arr):
+        self.arrays[key] = arr
+        self.num_bytes += arr.nbytes
+        while self.num_bytes > self.max_bytes and len(self.arrays) > 1:
+            _, evicted = self.arrays.popitem(last=False)
+            self.num_bytes -= evicted.nbytes
+        return arr
+
+
+class CompressedLevel:
+    # One pyramid level of a compressed heatmap stack. Windows are compressed separately and only decompressed
+    # when requested, the most recently used ones are kept up to max_bytes.
+    def __init__(self, levels, level, max_bytes=256 << 20):
+        self.levels = levels
+        self.keys = sorted(key for key in levels.files if key.startswith(f'level{level}_'))
+        self.cache = ArrayCache(max_bytes)
+        self.shape = (len(self.keys), *self.window(0).shape)
+
+    def window(self, idx):
+        heatmap = self.cache.get(idx)
+        if heatmap is None:
+            heatmap = self.cache.put(idx, self.levels[self.keys[idx]])
+        return heatmap
+
+    def __getitem__(self, indices):
+        return np.stack([self.window(idx) for idx in indices])
+
+
+def load_heatmap_levels(path):
+    # Stacked heatmaps hold one time x height x width array per pyramid level, compressed per window or memory-mapped
+    path = Path(path)
+    if (path / 'levels.npz').is_file():
+        levels = np.load(path / 'levels.npz')
+        num_levels = len({key.split('_')[0] for key in levels.files})
+        return [CompressedLevel(levels, idx) for idx in range(num_levels)]
+    return [np.load(path / f'level{idx}.npy', mmap_mode='r') for idx in range(len(list(path.glob('level*.npy'))))]
+
+
 class HeatmapOverlayProvider(QQuickImageProvider):
     def __init__(self, files, cmap='CET_L8'):
         super(HeatmapOverlayProvider, self).__init__(QQuickImageProvider.ImageType.Image)
         self.files = files
+        self.stacked = files is not None and 'index' in files.columns
+        self.levels = {}
         self.segments_start = []
         self.segments_end = []
         self.set_colormap(cmap)
@@ -65,14 +121,44 @@ class HeatmapOverlayProvider(QQuickImageProvider):
     def set_colormap(self, cmap_str):
         self.colormap = get_colormap(cmap_str, 9)
         
-    def compute_overlay(self, start, end):
+    def heatmap_levels(self, filename):
+        if filename not in self.levels:
+            self.levels[filename] = load_heatmap_levels(filename)
+        return self.levels[filename]
+
+    def level_shapes(self):
+        if not self.stacked:
+            return []
+        return [stack.shape[1:] for stack in self.heatmap_levels(self.files.iloc[0]['filename'])]
+
+    def overlay_level(self, requested_size):
+        if requested_size.width() <= 0 or requested_size.height() <= 0:
+            return 0
+
+        # Coarsest pyramid level that still covers the requested size
+        level = 0
+        for idx, (height, width) in enumerate(self.level_shapes()):
+            if width >= requested_size.width() and height >= requested_size.height():
+                level = idx
+        return level
+
+    def compute_overlay(self, start, end, level=0):
         mask = (self.files['start timestamp [sec]'] >= start) & (self.files['end timestamp [sec]'] <= end)
 
         if mask.sum() == 0:
             logging.warning(f'No heatmap found in time span {start} -- {end}!')
+            if self.stacked:
+                return np.zeros(self.heatmap_levels(self.files.iloc[0]['filename'])[level].shape[1:], dtype=np.float16)
             return np.zeros_like(np.load(self.files.iloc[0]['filename']))
 
         arr = 0
+        if self.stacked:
+            for filename, rows in self.files[mask].groupby('filename'):
+                stack = self.heatmap_levels(filename)[level]
+                arr = arr + stack[np.sort(rows['index'].to_numpy())].sum(axis=0, dtype=np.float32)
+            return arr / len(mask.index)
+
+        # One .npy file per window
         for _, row in self.files[mask].iterrows():
             arr += np.load(row['filename'])
         return arr / len(mask.index)
@@ -80,7 +166,8 @@ class HeatmapOverlayProvider(QQuickImageProvider):
     def requestImage(self, img_id, requested_size):
         segment_idx = int(img_id)
         try: 
-            self.img = create_heatmap_img(self.compute_overlay(self.segments_start[segment_idx], self.segments_end[segment_idx]), colormap=self.colormap)
+            level = self.overlay_level(requested_size)
+            self.img = create_heatmap_img(self.compute_overlay(self.segments_start[segment_idx], self.segments_end[segment_idx], level=level), colormap=self.colormap)
             qimg = QImage(self.img.data, self.img.shape[1], self.img.shape[0], self.img.strides[0], QImage.Format.Format_RGBA8888)
 
             if requested_size.width() > 0 and requested_size.height() > 0:
@@ -90,3 +177,69 @@ class HeatmapOverlayProvider(QQuickImageProvider):
             print(err)
 
         return qimg, qimg.size()
+
+
+def gaussian_kernel_1d(l):
+    sig = (l - 1) / 8.
+    ax = np.linspace(-(l - 1) / 2., (l - 1) / 2., l)
+    kernel = np.exp(-0.5 * np.square(ax) / np.square(sig))
+    return kernel / np.sum(kernel)
+
+
+class PointsOverlayProvider(HeatmapOverlayProvider):
+    # Rasterizes heatmaps from fixation points for the exact time span of a segment, at level N the
+    # heatmap has 1/2^N of the video resolution. Heatmaps are cached per time span and level, images of
+    # any size and colormap are created from them.
+    def __init__(self, points, cmap='CET_L8', min_size=32, max_cache_bytes=256 << 20):
+        super(PointsOverlayProvider, self).__init__(None, cmap=cmap)
+        self.start = points['start']
+        self.end = points['end']
+        self.pos_x = points['pos_x']
+        self.pos_y = points['pos_y']
+        self.weight = points['weight']
+        self.size = tuple(int(v) for v in points['size'])
+        self.kernel_size = int(points['kernel_size'])
+        self.min_size = min_size
+        self.cache = ArrayCache(max_cache_bytes)
+
+    def level_shapes(self):
+        shapes = [self.size]
+        while min(shapes[-1]) // 2 >= self.min_size:
+            shapes.append((-(-shapes[-1][0] // 2), -(-shapes[-1][1] // 2)))
+        return shapes
+
+    def compute_overlay(self, start, end, level=0):
+        heatmap = self.cache.get((start, end, level))
+        if heatmap is None:
+            heatmap = self.cache.put((start, end, level), self.rasterize(start, end, level))
+        return heatmap
+
+    def rasterize(self, start, end, level):
+        height, width = self.level_shapes()[level]
+        scale = width / self.size[1]
+
+        # Points are sorted by start time, the span is located by binary search
+        lo = np.searchsorted(self.start, start, side='left')
+        hi = np.searchsorted(self.start, end, side='right')
+        within_range = self.end[lo:hi] <= end
+
+        pos_x = (self.pos_x[lo:hi][within_range] * scale).astype(int).clip(0, width - 1)
+        pos_y = (self.pos_y[lo:hi][within_range] * scale).astype(int).clip(0, height - 1)
+        weights = self.weight[lo:hi][within_range]
+
+        heatmap = np.zeros((height, width))
+        if len(weights) == 0:
+            logging.warning(f'No fixations found in time span {start} -- {end}!')
+            return heatmap
+
+        # The kernel shrinks with the level so the heatmap keeps its extent relative to the video
+        ksh = int(round((self.kernel_size // 2) * scale))
+        kernel_1d = gaussian_kernel_1d(2 * ksh + 1)
+
+        # Only the bounding box of the fixations, padded by the kernel radius, is binned and smoothed by FFT convolution
+        x0, x1 = max(pos_x.min() - ksh, 0), min(pos_x.max() + ksh + 1, width)
+        y0, y1 = max(pos_y.min() - ksh, 0), min(pos_y.max() + ksh + 1, height)
+        box = np.bincount((pos_y - y0) * (x1 - x0) + pos_x - x0, weights=weights, minlength=(y1 - y0) * (x1 - x0)).astype(float, copy=False).reshape(y1 - y0, x1 - x0)
+        box = fftconvolve(box, kernel_1d[:, None], mode='same', axes=0)
+        heatmap[y0: y1, x0: x1] = fftconvolve(box, kernel_1d[None, :], mode='same', axes=1)
+        return heatmap
@@ -30,7 +30,7 @@ class SegmentModel(QObject):
     queryResultsAvailable = pyqtSignal(int, list, list)
 
     def __init__(
-        self, segments, multimodal_recordings, meta_model, video_src, parent=None
+        self, segments, multimodal_recordings, meta_model, video_src, proxy_src=None, parent=None
     ):
         super().__init__(parent)
         self.meta_model = meta_model
@@ -46,6 +46,7 @@ class SegmentModel(QObject):
         self.thumbnail_provider = ThumbnailProvider()
 
         self.video_src = video_src
+        self.proxy_src = proxy_src if proxy_src is not None else {}
         self.has_attention = False
         self.has_activity = False
         self.has_gaze_heatmaps = False
@@ -396,13 +397,27 @@ class SegmentModel(QObject):
 
         # TODO Merge heatmaps
 
+    def video_url(self, name, full_resolution=False):
+        # Proxy videos are used for playback if registered, the originals for full resolution crops
+        if name in self.proxy_src and not full_resolution:
+            return "file:///" + str(self.proxy_src[name]["path"])
+        return "file:///" + str(self.video_src[name]["path"])
+
     @pyqtSlot(result=str)
     def VideoSourceTopDown(self):
-        return "file:///" + self.video_src["workspace"]["path"]
+        return self.video_url("workspace")
 
     @pyqtSlot(result=list)
     def VideoSourcesPeripheral(self):
-        return ["file:///" + str(self.video_src["room"]["path"])]
+        return [self.video_url("room")]
+
+    @pyqtSlot(result=str)
+    def VideoSourceTopDownFull(self):
+        return self.video_url("workspace", full_resolution=True)
+
+    @pyqtSlot(result=list)
+    def VideoSourcesPeripheralFull(self):
+        return [self.video_url("room", full_resolution=True)]
 
     @pyqtSlot(result=int)
     def SpeechLineCount(self):
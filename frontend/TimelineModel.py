@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import logging
 
 from collections import defaultdict
@@ -10,20 +11,49 @@ pd.options.mode.chained_assignment = None  # default='warn'
 
 
 def merge_entries(df, time_delta_threshold=.5):
-    merged_rows = []
-    for _, row in df.iterrows():
-        if len(merged_rows) > 1:
-            time_delta = row['start timestamp [sec]'] - merged_rows[-1]['end timestamp [sec]']
-            event_subtype_match = row['event subtype'] == merged_rows[-1]['event subtype']
-
-            if time_delta < time_delta_threshold and event_subtype_match:
-                merged_rows[-1]['end timestamp [sec]'] = row['end timestamp [sec]']
-                merged_rows[-1]['event data'] = merged_rows[-1]['event data'] + " " + row['event data']
-            else:
-                merged_rows.append(row)
-        else:
-            merged_rows.append(row)
-    return pd.DataFrame(merged_rows)
+    if len(df.index) < 3:
+        return df
+
+    start_ts = df['start timestamp [sec]'].to_numpy()
+    end_ts = df['end timestamp [sec]'].to_numpy()
+    subtypes = df['event subtype'].to_numpy()
+
+    # An entry is merged into its predecessor if it follows shortly and has the same subtype.
+    # The first two entries always start a new group.
+    merge = np.zeros(len(df.index), dtype=bool)
+    merge[2:] = (start_ts[2:] - end_ts[1:-1] < time_delta_threshold) & (subtypes[2:] == subtypes[1:-1])
+    groups = np.cumsum(~merge) - 1
+
+    merged = df[~merge].copy()
+    merged['end timestamp [sec]'] = end_ts[np.r_[np.flatnonzero(~merge)[1:] - 1, len(df.index) - 1]]
+
+    multiple = np.bincount(groups) > 1
+    if multiple.any():
+        event_data = df['event data'][multiple[groups]].groupby(groups[multiple[groups]]).agg(join_event_data)
+        merged.iloc[event_data.index, merged.columns.get_loc('event data')] = event_data.to_numpy()
+    return merged
+
+
+def join_event_data(values):
+    # Text is joined by spaces, fixation positions are concatenated
+    values = list(values)
+    if isinstance(values[0], str):
+        return ' '.join(values)
+    return tuple(chain.from_iterable(values))
+
+
+def format_event_data(event_data):
+    if isinstance(event_data, str):
+        return event_data
+    return ' '.join(f'{x};{y}' for x, y in event_data)
+
+
+def with_event_data(df):
+    # Mapped fixations carry typed positions, every entry holds a tuple of (x, y) positions that is only formatted for display
+    if 'event data' not in df.columns and {'mapped x [px]', 'mapped y [px]'}.issubset(df.columns):
+        positions = zip(df['mapped x [px]'].astype(int).tolist(), df['mapped y [px]'].astype(int).tolist())
+        df['event data'] = pd.Series([(pos,) for pos in positions], index=df.index, dtype=object)
+    return df
 
 
 class SubjectData(QObject):
@@ -54,7 +84,7 @@ class SubjectMultimodalData(QObject):
             multimodal_data = {}
 
             for data_type in rec['artifacts']:
-                data_table = pd.read_csv(rec['artifacts'][data_type]['path'])
+                data_table = with_event_data(pd.read_csv(rec['artifacts'][data_type]['path']))
                 data_table = merge_entries(data_table)
                 data_table = data_table[(data_table['start timestamp [sec]'] >= min_timestamp) & (data_table['end timestamp [sec]'] <= max_timestamp)]
 
@@ -147,13 +177,12 @@ class SubjectData(QObject):
         
     @pyqtSlot(result=str)
     def FullText(self):
-        full_text = ' '.join(self.event_data)
+        full_text = ' '.join(format_event_data(event_data) for event_data in self.event_data)
         return f'{self.sid} : "{full_text}"'
 
     @pyqtSlot(result=bool)
     def HasText(self):
-        full_text = ''.join(self.event_data)
-        return len(full_text) > 0
+        return any(len(event_data) > 0 for event_data in self.event_data)
 
     @pyqtSlot(int, result=float)
     def PosStartSec(self, index):
@@ -195,7 +224,7 @@ class SubjectData(QObject):
 
     @pyqtSlot(int, result=str)
     def EventData(self, index):
-        return self.event_data[index]
+        return format_event_data(self.event_data[index])
     
     @pyqtSlot(result=int)
     def rowCount(self):
@@ -19,6 +19,10 @@ Rectangle {
     required property string topDownSource
     required property list<string> peripheralSources
 
+    // Full resolution videos, only loaded while selecting crops
+    property string topDownSourceFull: topDownSource
+    property list<string> peripheralSourcesFull: peripheralSources
+
     property alias playbackState: video.playbackState
     property int startPosition
     property int endPosition
@@ -46,6 +50,28 @@ Rectangle {
         video.setPosition(posMsec);
     }
 
+    function currentSource() {
+        const fullResolution = videoRoot.selectionMode > 0;
+        if (bar.currentIndex === 0) {
+            return fullResolution ? videoRoot.topDownSourceFull : videoRoot.topDownSource;
+        }
+        return (fullResolution ? videoRoot.peripheralSourcesFull : videoRoot.peripheralSources)[bar.currentIndex - 1];
+    }
+
+    function updateSource() {
+        const source = currentSource();
+        if (video.source.toString() === source) {
+            return;
+        }
+        video.savedPosition = video.position;
+        video.savedPlaybackState = video.playbackState
+        video.source = source;
+    }
+
+    onSelectionModeChanged: {
+        updateSource();
+    }
+
     onActiveChanged: {
         if (!active) {
             video.pause();
@@ -97,9 +123,7 @@ Rectangle {
             Layout.fillWidth: true
 
             onCurrentIndexChanged: {
-                video.savedPosition = video.position;
-                video.savedPlaybackState = video.playbackState
-                video.source = (bar.currentIndex === 0) ? videoRoot.topDownSource : videoRoot.peripheralSources[bar.currentIndex - 1]
+                videoRoot.updateSource();
             }
 
             CustomTabButton {
@@ -107,6 +107,8 @@ Drawer {
                     active: drawer.drawerOpened
                     topDownSource: topicSegments.VideoSourceTopDown()
                     peripheralSources: topicSegments.VideoSourcesPeripheral()
+                    topDownSourceFull: topicSegments.VideoSourceTopDownFull()
+                    peripheralSourcesFull: topicSegments.VideoSourcesPeripheralFull()
                     colormapAOIs: drawer.colormap
 
                     onSelectionChanged: (frame, pos_ms, xpos, ypos, width, height, overlay_src) => {
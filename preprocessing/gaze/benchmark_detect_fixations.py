@@ -0,0 +1,80 @@
+import argparse
+import time
+import numpy as np
+
+from functools import partial
+
+from utils import detect_fixations_ivt, detect_fixations_idt
+
+
+def synthetic_gaze(duration_sec, rate_hz, noise_px, nan_gaps, drifts, rng):
+    # Fixations of 100-500 ms at random positions with noise, connected by instantaneous saccades
+    count = int(duration_sec * rate_hz)
+    timestamps_ns = np.arange(count, dtype=np.int64) * int(1e9 / rate_hz)
+    lengths = rng.integers(int(.1 * rate_hz), int(.5 * rate_hz), count // int(.1 * rate_hz))
+    centers = rng.uniform(0, 1000, (len(lengths), 2))
+    pos = np.repeat(centers, lengths, axis=0)[:count]
+
+    # Slow drifts of 400 px over 4 sec, e.g. smooth pursuit
+    drift_len = min(int(4 * rate_hz), count)
+    for start in rng.integers(0, count - drift_len + 1, drifts):
+        pos[start: start + drift_len] = pos[start] + np.linspace(0, 400, drift_len)[:, None]
+    pos += rng.normal(0, noise_px, (count, 2))
+
+    # Short runs of invalid samples, e.g. from blinks
+    for start in rng.integers(0, count - 20, nan_gaps):
+        pos[start: start + rng.integers(1, 20)] = np.nan
+    return timestamps_ns, pos[:, 0], pos[:, 1]
+
+
+def check_no_overlap(fixations):
+    assert (fixations['first sample'].to_numpy()[1:] > fixations['last sample'].to_numpy()[:-1]).all(), 'Fixations share samples!'
+
+
+def check_dispersion(fixations, pos_x, pos_y, dispersion_threshold):
+    for row in fixations.itertuples(index=False):
+        samples = slice(row[0], row[1] + 1)
+        assert np.ptp(pos_x[samples]) + np.ptp(pos_y[samples]) <= dispersion_threshold, 'Fixation exceeds the dispersion threshold!'
+
+
+def check_centroids(fixations, pos_x, pos_y):
+    for row in fixations.itertuples(index=False):
+        samples = slice(row[0], row[1] + 1)
+        assert np.isfinite(pos_x[samples]).all() and np.isfinite(pos_y[samples]).all(), 'Fixation contains invalid samples!'
+        assert np.isclose(row[5], pos_x[samples].mean()) and np.isclose(row[6], pos_y[samples].mean()), 'Fixation centroid differs from the mean of its samples!'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--durations_sec', type=float, nargs='+', default=[60, 600, 3600])
+    parser.add_argument('--rate_hz', type=float, default=200)
+    parser.add_argument('--noise_px', type=float, nargs='+', default=[.5, 3])
+    parser.add_argument('--nan_gaps', type=int, default=50)
+    parser.add_argument('--drifts', type=int, default=5)
+    parser.add_argument('--dispersion_threshold', type=float, default=25)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+
+    print(f'{"duration [s]":>12} {"noise [px]":>10} {"method":>6} {"time [s]":>9} {"fixations":>10}')
+    for duration_sec in args.durations_sec:
+        for noise_px in args.noise_px:
+            timestamps_ns, pos_x, pos_y = synthetic_gaze(duration_sec, args.rate_hz, noise_px, args.nan_gaps, args.drifts, rng)
+
+            methods = {
+                'ivt': detect_fixations_ivt,
+                'idt': partial(detect_fixations_idt, dispersion_threshold=args.dispersion_threshold),
+                'idt0': partial(detect_fixations_idt, dispersion_threshold=args.dispersion_threshold, min_duration_ms=0),
+            }
+            for method, detect in methods.items():
+                t0 = time.perf_counter()
+                fixations = detect(timestamps_ns, pos_x, pos_y)
+                elapsed = time.perf_counter() - t0
+
+                assert fixations[['fixation x [px]', 'fixation y [px]']].notna().all().all(), 'Invalid samples leak into fixation centroids!'
+                check_no_overlap(fixations)
+                check_centroids(fixations, pos_x, pos_y)
+                if method.startswith('idt'):
+                    check_dispersion(fixations, pos_x, pos_y, args.dispersion_threshold)
+                print(f'{duration_sec:>12g} {noise_px:>10g} {method:>6} {elapsed:>9.3f} {len(fixations.index):>10}')
@@ -0,0 +1,101 @@
+import argparse
+import json
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import shapely
+
+from pathlib import Path
+from map_fixations import fix2AOI, get_aois
+
+
+def fix2AOI_sequential(rec, aoi_path):
+    # Reference implementation testing one fixation against one AOI at a time
+    surface_gaze = pd.read_csv(rec['sources']['surface_fixations']['path'])
+    offset_sec = rec['sources']['surface_fixations']['offset_sec']
+
+    surface_gaze['mapped x [px]'] = surface_gaze['mapped x [px]'].astype(int)
+    surface_gaze['mapped y [px]'] = surface_gaze['mapped y [px]'].astype(int)
+
+    surface_gaze['start timestamp [sec]'] = surface_gaze['start timestamp [sec]'] - offset_sec
+    surface_gaze['end timestamp [sec]'] = surface_gaze['end timestamp [sec]'] - offset_sec
+
+    surface_gaze = surface_gaze[surface_gaze['within_surface']].copy()
+
+    aois = get_aois(aoi_path)
+    labels = []
+
+    for _, row in surface_gaze.iterrows():
+        point = shapely.Point((row[['mapped x [px]', 'mapped y [px]']]))
+        for label, poly in aois.items():
+            if poly.contains(point):
+                labels.append(label)
+                break
+        else:
+            labels.append('__NA__')
+
+    surface_gaze['mapped_aoi'] = labels
+    surface_gaze = surface_gaze[surface_gaze['mapped_aoi'] != '__NA__'].copy()
+    surface_gaze['duration [sec]'] = surface_gaze.apply(lambda row: row['end timestamp [sec]'] - row['start timestamp [sec]'], axis=1)
+    surface_gaze['event type'] = 'attention'
+    surface_gaze['event subtype'] = surface_gaze['mapped_aoi']
+    surface_gaze = surface_gaze.drop(['mapped_aoi', 'within_surface'], axis=1)
+    return surface_gaze
+
+
+def synthetic_aois(width, height, rows, cols, rng):
+    shapes = []
+    cell_w, cell_h = width / cols, height / rows
+    for r in range(rows):
+        for c in range(cols):
+            cx, cy = (c + .5) * cell_w, (r + .5) * cell_h
+            angles = np.sort(rng.uniform(0, 2 * np.pi, 8))
+            radius = rng.uniform(.4, .7, 8) * min(cell_w, cell_h)
+            points = np.stack((cx + radius * np.cos(angles), cy + radius * np.sin(angles)), axis=1)
+            shapes.append({'label': f'aoi_{r}_{c}', 'points': points.tolist(), 'shape_type': 'polygon'})
+    return {'shapes': shapes, 'imageWidth': width, 'imageHeight': height}
+
+
+def synthetic_fixations(count, width, height, rng):
+    start_ts = np.sort(rng.uniform(0, 5000, count))
+    return pd.DataFrame({
+        'start timestamp [sec]': start_ts,
+        'end timestamp [sec]': start_ts + rng.uniform(.1, .8, count),
+        'mapped x [px]': rng.uniform(0, width, count),
+        'mapped y [px]': rng.uniform(0, height, count),
+        'within_surface': rng.uniform(size=count) < .9,
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--fixation_counts', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        aoi_path = Path(tmp_dir) / 'aois_labelme.json'
+        fix_path = Path(tmp_dir) / 'surface_fixations.csv'
+
+        with open(aoi_path, 'w') as f:
+            json.dump(synthetic_aois(args.width, args.height, rows=3, cols=4, rng=rng), f)
+
+        rec = {'id': 'benchmark', 'sources': {'surface_fixations': {'path': str(fix_path), 'offset_sec': 10.0}}}
+
+        print(f'{"fixations":>10} {"sequential [s]":>15} {"batched [s]":>12} {"speedup":>8}')
+        for count in args.fixation_counts:
+            synthetic_fixations(count, args.width, args.height, rng).to_csv(fix_path, index=None)
+
+            t0 = time.perf_counter()
+            expected = fix2AOI_sequential(rec, aoi_path)
+            t1 = time.perf_counter()
+            actual = fix2AOI(rec, aoi_path)
+            t2 = time.perf_counter()
+
+            assert expected.to_csv(index=None) == actual.to_csv(index=None), 'Batched mapping differs from sequential mapping!'
+            print(f'{count:>10} {t1 - t0:>15.3f} {t2 - t1:>12.3f} {(t1 - t0) / (t2 - t1):>7.1f}x')
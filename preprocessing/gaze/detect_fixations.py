@@ -0,0 +1,64 @@
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from utils import gaze_arrays, detect_fixations_ivt, detect_fixations_idt, world_timestamps
+
+
+def surface_fixations(fixations, reference_ns, within_surface):
+    # A fixation lies on the surface if the majority of its gaze samples do
+    cum_within = np.concatenate(([0], np.cumsum(np.asarray(within_surface, dtype=float))))
+    first, last = fixations['first sample'].to_numpy(), fixations['last sample'].to_numpy()
+    within = (cum_within[last + 1] - cum_within[first]) / (last - first + 1) > .5
+
+    return pd.DataFrame({
+        'fixation id': np.arange(1, len(fixations.index) + 1),
+        'start timestamp [sec]': 1e-9 * (fixations['start timestamp [ns]'] - reference_ns),
+        'end timestamp [sec]': 1e-9 * (fixations['end timestamp [ns]'] - reference_ns),
+        'duration [ms]': fixations['duration [ms]'],
+        'mapped x [px]': fixations['fixation x [px]'],
+        'mapped y [px]': fixations['fixation y [px]'],
+        'within_surface': within,
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rec_dir', type=Path, required=True)
+    parser.add_argument('--out_path', type=Path, required=True)
+    parser.add_argument('--method', choices=['ivt', 'idt'], default='ivt')
+    parser.add_argument('--velocity_threshold', type=float, default=500)
+    parser.add_argument('--dispersion_threshold', type=float, default=25)
+    parser.add_argument('--min_duration_ms', type=float, default=60)
+    parser.add_argument('--max_gap_ms', type=float, default=75)
+    parser.add_argument('--x_column', required=True)
+    parser.add_argument('--y_column', required=True)
+    parser.add_argument('--within_column', required=True)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+
+    # Gaze must already be mapped to the working area, AOIs are defined in its coordinates
+    columns = [args.x_column, args.y_column, args.within_column]
+    missing = [c for c in columns if c not in pd.read_csv(args.rec_dir / 'gaze.csv', nrows=0).columns]
+    if missing:
+        parser.error(f'Columns {missing} not found in "{args.rec_dir / "gaze.csv"}", surface mapped gaze coordinates and a within-surface column are required')
+    gaze = gaze_arrays(args.rec_dir, columns)
+    timestamps_ns = gaze['timestamp [ns]']
+
+    if args.method == 'ivt':
+        fixations = detect_fixations_ivt(timestamps_ns, gaze[args.x_column], gaze[args.y_column], velocity_threshold=args.velocity_threshold, min_duration_ms=args.min_duration_ms, max_gap_ms=args.max_gap_ms)
+    else:
+        fixations = detect_fixations_idt(timestamps_ns, gaze[args.x_column], gaze[args.y_column], dispersion_threshold=args.dispersion_threshold, min_duration_ms=args.min_duration_ms, max_gap_ms=args.max_gap_ms)
+
+    # Timestamps are relative to the first scene video frame, or the first gaze sample without one
+    if (args.rec_dir / 'world.csv').is_file():
+        reference_ns = world_timestamps(args.rec_dir)['timestamp [ns]'].iloc[0]
+    else:
+        reference_ns = timestamps_ns[0]
+
+    out = surface_fixations(fixations, reference_ns, gaze[args.within_column])
+    out.to_csv(args.out_path, index=None)
+    logging.info(f'Detected {len(out.index)} fixations in "{args.rec_dir / "gaze.csv"}"')
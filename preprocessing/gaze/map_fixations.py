@@ -1,5 +1,6 @@
 import argparse
 import pandas as pd
+import numpy as np
 import json
 import shapely
 
@@ -15,41 +16,55 @@ def get_aois(aoi_path):
         return shapes_geom
 
 
-def fix2AOI(rec, aoi_path):
-    surface_gaze = pd.read_csv(rec['sources']['surface_fixations']['path'])
-    offset_sec = rec['sources']['surface_fixations']['offset_sec']
+def map_points(pos_x, pos_y, aois, na_label='__NA__'):
+    labels = np.array(list(aois.keys()) + [na_label], dtype=object)
+    tree = shapely.STRtree(list(aois.values()))
+    points = shapely.points(np.asarray(pos_x, dtype=float), np.asarray(pos_y, dtype=float))
+
+    # Candidate pairs (point, polygon) of all points inside a polygon
+    point_idx, aoi_idx = tree.query(points, predicate='within')
+
+    # Keep the first matching AOI in labelme order, like a sequential scan would
+    first_match = np.full(len(points), len(aois))
+    np.minimum.at(first_match, point_idx, aoi_idx)
+    return labels[first_match]
 
+
+def map_fixations(surface_gaze, offset_sec, aois):
     surface_gaze['mapped x [px]'] = surface_gaze['mapped x [px]'].astype(int)
     surface_gaze['mapped y [px]'] = surface_gaze['mapped y [px]'].astype(int)
 
     surface_gaze['start timestamp [sec]'] = surface_gaze['start timestamp [sec]'] - offset_sec
     surface_gaze['end timestamp [sec]'] = surface_gaze['end timestamp [sec]'] - offset_sec
 
-    surface_gaze = surface_gaze[surface_gaze['within_surface']]
+    surface_gaze = surface_gaze[surface_gaze['within_surface']].copy()
+    surface_gaze['mapped_aoi'] = map_points(surface_gaze['mapped x [px]'], surface_gaze['mapped y [px]'], aois)
 
-    aois = get_aois(aoi_path)
-    labels = []
-
-    for _, row in surface_gaze.iterrows():
-        point = shapely.Point((row[['mapped x [px]', 'mapped y [px]']]))
-        for label, poly in aois.items():
-            if poly.contains(point):
-                labels.append(label)
-                break
-        else:
-            labels.append('__NA__')
-
-    surface_gaze['mapped_aoi'] = labels
     surface_gaze = surface_gaze[surface_gaze['mapped_aoi'] != '__NA__'].copy()
-    surface_gaze['event data'] = surface_gaze.apply(lambda row: f'{row["mapped x [px]"]};{row["mapped y [px]"]}', axis=1)
+    surface_gaze['duration [sec]'] = surface_gaze['end timestamp [sec]'] - surface_gaze['start timestamp [sec]']
     surface_gaze['event type'] = 'attention'
     surface_gaze['event subtype'] = surface_gaze['mapped_aoi']
-    surface_gaze = surface_gaze.drop(['mapped_aoi', 'within_surface', 'mapped x [px]', 'mapped y [px]'], axis=1)
+    surface_gaze = surface_gaze.drop(['mapped_aoi', 'within_surface'], axis=1)
     return surface_gaze
 
 
+def fix2AOI(rec, aoi_path):
+    surface_gaze = pd.read_csv(rec['sources']['surface_fixations']['path'])
+    offset_sec = rec['sources']['surface_fixations']['offset_sec']
+    return map_fixations(surface_gaze, offset_sec, get_aois(aoi_path))
+
+
+def fix2AOI_chunked(rec, aoi_path, chunk_size):
+    offset_sec = rec['sources']['surface_fixations']['offset_sec']
+    aois = get_aois(aoi_path)
+
+    with pd.read_csv(rec['sources']['surface_fixations']['path'], chunksize=chunk_size) as reader:
+        for surface_gaze in reader:
+            yield map_fixations(surface_gaze, offset_sec, aois)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--manifest', type=Path, required=True)
     parser.add_argument('--out_dir', type=Path, required=True)
-    args = parser.parse_args()
\ No newline at end of file
+    args = parser.parse_args()
@@ -7,75 +7,179 @@ import numpy as np
 import argparse
 import logging
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 from pathlib import Path
-from map_fixations import fix2AOI
+from map_fixations import fix2AOI, fix2AOI_chunked
 from manifest_manager import ManifestManager
 
 
+def interval_bin_durations(start_ts, end_ts, codes, num_codes, min_timestamp, num_bins, bin_width_sec):
+    start_ts = np.asarray(start_ts, dtype=float)
+    end_ts = np.asarray(end_ts, dtype=float)
+    codes = np.asarray(codes, dtype=np.int64)
+
+    # Bins covering the start and end of each interval
+    first_bin = np.floor((start_ts - min_timestamp) / bin_width_sec).astype(np.int64)
+    last_bin = np.floor((end_ts - min_timestamp) / bin_width_sec).astype(np.int64)
+    first_bin_end = min_timestamp + (first_bin + 1) * bin_width_sec
+    last_bin_start = min_timestamp + last_bin * bin_width_sec
+
+    # Partial overlap with the first and last bin of each interval
+    single_bin = first_bin == last_bin
+    head = np.where(single_bin, end_ts - start_ts, first_bin_end - start_ts)
+    tail = np.where(single_bin, 0, end_ts - last_bin_start)
+
+    durations = np.zeros(num_codes * num_bins)
+    for bins, dur in ((first_bin, head), (last_bin, tail)):
+        valid = (bins >= 0) & (bins < num_bins)
+        durations += np.bincount(codes[valid] * num_bins + bins[valid], weights=dur[valid], minlength=num_codes * num_bins)
+
+    # Bins fully covered in between are counted with a cumulative sum over bin edges
+    covered = np.zeros((num_codes, num_bins + 1))
+    spans = last_bin > first_bin + 1
+    np.add.at(covered, (codes[spans], np.clip(first_bin[spans] + 1, 0, num_bins)), 1)
+    np.add.at(covered, (codes[spans], np.clip(last_bin[spans], 0, num_bins)), -1)
+    covered = np.cumsum(covered, axis=1)[:, :num_bins]
+
+    return durations.reshape(num_codes, num_bins) + covered * bin_width_sec
+
+
+class AttentionAccumulator:
+    def __init__(self, min_timestamp, max_timestamp, bin_width_sec=1):
+        self.min_timestamp = min_timestamp
+        self.max_timestamp = max_timestamp
+        self.bin_width_sec = bin_width_sec
+        self.num_bins = len(np.arange(min_timestamp, max_timestamp, bin_width_sec))
+        self.durations = {}
+
+    def add(self, data_table):
+        data_table = data_table[(data_table['start timestamp [sec]'] >= self.min_timestamp) & (data_table['end timestamp [sec]'] <= self.max_timestamp)]
+        codes, categories = pd.factorize(data_table['event subtype'])
+        durations = interval_bin_durations(data_table['start timestamp [sec]'], data_table['end timestamp [sec]'], codes, len(categories), self.min_timestamp, self.num_bins, self.bin_width_sec)
+
+        for idx, c in enumerate(categories):
+            if c not in self.durations:
+                self.durations[c] = np.zeros(self.num_bins)
+            self.durations[c] += durations[idx]
+
+    def merge(self, other):
+        for c, dur in other.durations.items():
+            if c not in self.durations:
+                self.durations[c] = np.zeros(self.num_bins)
+            self.durations[c] += dur
+
+    def signals(self, num_recordings):
+        if not self.durations:
+            raise ValueError('Provided recordings exhibit no gaze data!')
+
+        time_series = {c: dur / (num_recordings*self.bin_width_sec) for c, dur in self.durations.items()}
+        return pd.DataFrame.from_dict(time_series)
+
+
 def compute_attention_signals(dfs, min_timestamp, max_timestamp, bin_width_sec=1):
-    num_dfs = len(dfs)
-    data_table = pd.concat(dfs)
-    data_table = data_table[(data_table['start timestamp [sec]'] >= min_timestamp) & (data_table['end timestamp [sec]'] <= max_timestamp)]
-    data_table = data_table[['start timestamp [sec]', 'end timestamp [sec]', 'event subtype']]
+    accumulator = AttentionAccumulator(min_timestamp, max_timestamp, bin_width_sec)
+    for df in dfs:
+        accumulator.add(df)
+    return accumulator.signals(len(dfs))
 
-    if data_table.empty:
-        raise ValueError('Provided recordings exhibit no gaze data!')
 
-    time_series = {c: list() for c in data_table['event subtype'].unique()}
+def map_recording(rec, aoi_path, out_path, min_timestamp, max_timestamp, bin_width_sec, chunk_size=None):
+    accumulator = AttentionAccumulator(min_timestamp, max_timestamp, bin_width_sec)
 
-    for start_sec in tqdm(np.arange(min_timestamp, max_timestamp, bin_width_sec)):
-        df_copy = data_table.copy(True)
-        df_copy['start timestamp [sec]'] = df_copy['start timestamp [sec]'].clip(start_sec, start_sec + bin_width_sec)
-        df_copy['end timestamp [sec]'] = df_copy['end timestamp [sec]'].clip(start_sec, start_sec + bin_width_sec)
-        df_copy['duration [sec]'] = df_copy['end timestamp [sec]'] - df_copy['start timestamp [sec]']
+    if chunk_size is None:
+        chunks = [fix2AOI(rec, aoi_path)]
+    else:
+        chunks = fix2AOI_chunked(rec, aoi_path, chunk_size)
 
-        out = df_copy.groupby('event subtype').agg("sum")
-        for c in time_series.keys():
-            norm_aoi_dur = out.loc[c, 'duration [sec]'] / (num_dfs*bin_width_sec) 
-            time_series[c].append(norm_aoi_dur if c in out.index else 0)
+    # Chunks are appended to disk and binned right away, so only one chunk is held in memory
+    for idx, surface_gaze in enumerate(chunks):
+        surface_gaze.to_csv(out_path, index=None, mode='w' if idx == 0 else 'a', header=idx == 0)
+        accumulator.add(surface_gaze)
+    return accumulator
 
-    time_series = {c: np.array(v) for c, v in time_series.items()}
-    out =  pd.DataFrame.from_dict(time_series)
-    return out
 
+def map_recordings(jobs, workers=1, **kwargs):
+    if workers <= 1:
+        for idx, (rec, out_path) in enumerate(jobs):
+            try:
+                yield idx, map_recording(rec, out_path=out_path, **kwargs)
+            except Exception as e:
+                yield idx, e
+        return
 
-def process_recordings(recordings, aoi_path, root_dir):
-    mapped_fix = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(map_recording, rec, out_path=out_path, **kwargs): idx for idx, (rec, out_path) in enumerate(jobs)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
 
-    for rec in tqdm(recordings, disable=True):
+
+def process_recordings(recordings, aoi_path, root_dir, accumulator, chunk_size=None, workers=1, allow_partial=False):
+    jobs = []
+
+    for rec in recordings:
         if 'surface_fixations' not in rec['sources']:
             logging.info(f'"surface_fixations" is not a registered source in recording "{rec["id"]}".')
             continue
 
         out_dir = root_dir / rec['id']
         out_dir.mkdir(exist_ok=True)
+        jobs.append((rec, out_dir / 'mapped_fix.csv'))
+
+    results = {}
+    failed = []
+    mapped = map_recordings(jobs, workers=workers, aoi_path=aoi_path, min_timestamp=accumulator.min_timestamp, max_timestamp=accumulator.max_timestamp, bin_width_sec=accumulator.bin_width_sec, chunk_size=chunk_size)
+
+    for idx, result in tqdm(mapped, total=len(jobs), unit='recording'):
+        rec_id = jobs[idx][0]['id']
+        if isinstance(result, Exception):
+            logging.error(f'Mapping fixations of recording "{rec_id}" failed: {result!r}')
+            failed.append(rec_id)
+            # Chunked mapping may have left a partial file behind
+            jobs[idx][1].unlink(missing_ok=True)
+        else:
+            logging.info(f'Mapped fixations of recording "{rec_id}"')
+            results[idx] = result
+
+    # Results are merged and registered in manifest order, regardless of completion order
+    for idx, (rec, out_path) in enumerate(jobs):
+        if idx not in results:
+            continue
 
-        surface_gaze = fix2AOI(rec, aoi_path)
-        out_path = out_dir / 'mapped_fix.csv'
-
+        accumulator.merge(results[idx])
         rec['artifacts']['mapped_fixations'] = {'path': str(out_path), 'categories': 'areas_of_interests'}
         logging.info(f'Registered "mapped_fixation" as an artifact in recording "{rec["id"]}"')
 
-        surface_gaze.to_csv(out_path, index=None)
-        mapped_fix.append(surface_gaze)
-    return mapped_fix
+    # The attention signal is averaged over recordings, a subset is only used if explicitly allowed
+    if failed and not allow_partial:
+        raise RuntimeError(f'Mapping fixations failed for recordings {failed}, use --allow_partial to compute attention from the remaining recordings')
+    if failed:
+        logging.warning(f'Computing attention from {len(results)} of {len(jobs)} recordings')
+    return len(results)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--manifest', type=Path, required=True)
     parser.add_argument('--out_dir', type=Path, required=True)
+    parser.add_argument('--bin_width_sec', type=float, default=0.5)
+    parser.add_argument('--chunk_size', type=int, required=False)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--allow_partial', action='store_true')
     args = parser.parse_args()
 
     logging.getLogger().setLevel(logging.INFO)
 
     with ManifestManager(args.manifest) as man:
-        mapped_fix = process_recordings(man.get_recordings(), man.get_areas_of_interests()['path'], args.out_dir)
+        accumulator = AttentionAccumulator(min_timestamp=0, max_timestamp=man.get_duration_sec(), bin_width_sec=args.bin_width_sec)
+        num_mapped = process_recordings(man.get_recordings(), man.get_areas_of_interests()['path'], args.out_dir, accumulator, chunk_size=args.chunk_size, workers=args.workers, allow_partial=args.allow_partial)
 
         out_path = args.out_dir / 'attention.csv'
-        attention_signals = compute_attention_signals(mapped_fix, min_timestamp=0, max_timestamp=man.get_duration_sec(), bin_width_sec=0.5)
+        attention_signals = accumulator.signals(num_mapped)
         attention_signals.to_csv(out_path, index=None)
 
         man.register_multi_time('attention', {'path': str(out_path), 'categories': 'areas_of_interests'})
-        logging.info('Registered "multi_time/attention" as an global artifact')
\ No newline at end of file
+        logging.info('Registered "multi_time/attention" as an global artifact')
@@ -44,4 +44,119 @@ def load_gaze(rec_dir):
     df['frame'] = df['world_frame_index']
     df = df.drop(['world_frame_index'], axis=1)
 
-    return df
\ No newline at end of file
+    return df
+
+def gaze_arrays(rec_dir, columns, timestamp_column='timestamp [ns]'):
+    # Columns of gaze.csv are converted once to .npy files and memory mapped afterwards
+    csv_path = rec_dir / 'gaze.csv'
+    cache_dir = rec_dir / 'gaze_npy'
+    columns = [timestamp_column] + [c for c in columns if c != timestamp_column]
+    paths = {c: cache_dir / (c.replace(' ', '_').replace('[', '').replace(']', '') + '.npy') for c in columns}
+
+    if any(not p.is_file() or p.stat().st_mtime < csv_path.stat().st_mtime for p in paths.values()):
+        cache_dir.mkdir(exist_ok=True)
+        df = pd.read_csv(csv_path, usecols=columns, dtype={timestamp_column: np.int64})
+        for c, p in paths.items():
+            np.save(p, df[c].to_numpy())
+
+    return {c: np.load(p, mmap_mode='r') for c, p in paths.items()}
+
+
+def group_runs(mask):
+    # First and last index of each run of consecutive True values
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+
+def fixation_table(timestamps_ns, pos_x, pos_y, first_sample, last_sample, min_duration_ms):
+    duration_ns = timestamps_ns[last_sample] - timestamps_ns[first_sample]
+    keep = duration_ns >= min_duration_ms * 1e6
+    first_sample, last_sample = first_sample[keep], last_sample[keep]
+
+    # Centroids from cumulative sums over the valid samples of each fixation, invalid samples add nothing
+    valid = np.isfinite(pos_x) & np.isfinite(pos_y)
+    cum_valid = np.concatenate(([0], np.cumsum(valid)))
+    cum_x = np.concatenate(([0], np.cumsum(np.where(valid, pos_x, 0.), dtype=float)))
+    cum_y = np.concatenate(([0], np.cumsum(np.where(valid, pos_y, 0.), dtype=float)))
+    num_samples = np.maximum(cum_valid[last_sample + 1] - cum_valid[first_sample], 1)
+
+    return pd.DataFrame({
+        'first sample': first_sample,
+        'last sample': last_sample,
+        'start timestamp [ns]': timestamps_ns[first_sample],
+        'end timestamp [ns]': timestamps_ns[last_sample],
+        'duration [ms]': 1e-6 * duration_ns[keep],
+        'fixation x [px]': (cum_x[last_sample + 1] - cum_x[first_sample]) / num_samples,
+        'fixation y [px]': (cum_y[last_sample + 1] - cum_y[first_sample]) / num_samples,
+    })
+
+
+def detect_fixations_ivt(timestamps_ns, pos_x, pos_y, velocity_threshold=500, min_duration_ms=60, max_gap_ms=75):
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    pos_x = np.asarray(pos_x, dtype=float)
+    pos_y = np.asarray(pos_y, dtype=float)
+
+    # Velocity in px/sec between consecutive samples, gaps and invalid samples break fixations
+    dt_sec = np.diff(timestamps_ns) * 1e-9
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity = np.hypot(np.diff(pos_x), np.diff(pos_y)) / dt_sec
+    slow = (velocity < velocity_threshold) & (dt_sec > 0) & (dt_sec <= max_gap_ms * 1e-3)
+
+    # A run of slow steps between samples i..j forms a fixation covering samples i..j+1
+    first_step, last_step = group_runs(slow)
+    return fixation_table(timestamps_ns, pos_x, pos_y, first_step, last_step + 1, min_duration_ms)
+
+
+def detect_fixations_idt(timestamps_ns, pos_x, pos_y, dispersion_threshold=25, min_duration_ms=60, max_gap_ms=75):
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    pos_x = np.asarray(pos_x, dtype=float)
+    pos_y = np.asarray(pos_y, dtype=float)
+    count = len(timestamps_ns)
+
+    # Initial window length in samples covering the minimum duration at the median sampling rate. A fixation
+    # spans at least two samples, also for a minimum duration of zero.
+    dt_ns = np.diff(timestamps_ns)
+    window = 2 if count < 2 else max(int(np.ceil(min_duration_ms * 1e6 / np.median(dt_ns))) + 1, 2)
+    if count < window:
+        return fixation_table(timestamps_ns, pos_x, pos_y, np.array([], dtype=int), np.array([], dtype=int), min_duration_ms)
+
+    # A sample continues the window before it if it is valid and not separated from it by a gap
+    valid = np.isfinite(pos_x) & np.isfinite(pos_y)
+    joins = valid & np.concatenate(([False], (dt_ns >= 0) & (dt_ns <= max_gap_ms * 1e6)))
+    breaks = np.concatenate(([0], np.cumsum(~joins)))
+
+    # Initial windows within the dispersion threshold that start at a valid sample and contain no gaps
+    windows_x = np.lib.stride_tricks.sliding_window_view(pos_x, window)
+    windows_y = np.lib.stride_tricks.sliding_window_view(pos_y, window)
+    dispersion = np.ptp(windows_x, axis=1) + np.ptp(windows_y, axis=1)
+    candidates = np.flatnonzero((dispersion <= dispersion_threshold) & valid[:count - window + 1] & (breaks[window:] == breaks[1:count - window + 2]))
+
+    first_sample, last_sample = [], []
+    idx = 0
+    while idx < len(candidates):
+        start = candidates[idx]
+        end = start + window - 1
+        min_x, max_x = pos_x[start: end + 1].min(), pos_x[start: end + 1].max()
+        min_y, max_y = pos_y[start: end + 1].min(), pos_y[start: end + 1].max()
+
+        # The window grows by the following samples as long as the dispersion of the whole window stays within the threshold.
+        # Samples are added in blocks, the extremes of the grown window are running minima and maxima.
+        while end + 1 < count:
+            block = slice(end + 1, min(end + 1 + window, count))
+            run_min_x, run_max_x = np.minimum(min_x, np.minimum.accumulate(pos_x[block])), np.maximum(max_x, np.maximum.accumulate(pos_x[block]))
+            run_min_y, run_max_y = np.minimum(min_y, np.minimum.accumulate(pos_y[block])), np.maximum(max_y, np.maximum.accumulate(pos_y[block]))
+            fits = joins[block] & (run_max_x - run_min_x + run_max_y - run_min_y <= dispersion_threshold)
+
+            num = len(fits) if fits.all() else int(np.argmin(fits))
+            if num > 0:
+                end += num
+                min_x, max_x, min_y, max_y = run_min_x[num - 1], run_max_x[num - 1], run_min_y[num - 1], run_max_y[num - 1]
+            if num < len(fits):
+                break
+
+        # Detection continues after the fixation, fixations never share samples
+        first_sample.append(start)
+        last_sample.append(end)
+        idx = np.searchsorted(candidates, end + 1)
+
+    return fixation_table(timestamps_ns, pos_x, pos_y, np.array(first_sample, dtype=int), np.array(last_sample, dtype=int), min_duration_ms)
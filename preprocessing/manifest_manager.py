@@ -129,6 +129,22 @@ class ManifestManager:
             msg = f'{name} are is a registered video overlay'
             raise Exception(msg) from e
 
+    def get_frame_store(self, name):
+        try: 
+            frame_stores = self.get_artifact('frame_store')
+            return frame_stores[name]
+        except Exception as e:
+            msg = f'{name} has no registered frame store'
+            raise Exception(msg) from e
+
+    def get_proxy_video(self, name):
+        try: 
+            proxy_videos = self.get_artifact('proxy_video')
+            return proxy_videos[name]
+        except Exception as e:
+            msg = f'{name} has no registered proxy video'
+            raise Exception(msg) from e
+
     def register_artifact(self, name, val, overwrite=True):
         if 'artifacts' not in self.manifest_json:
             self.manifest_json['artifacts'] = {}
@@ -148,4 +164,12 @@ class ManifestManager:
 
     def register_multi_time(self, name, val):
         self.register_artifact('multi_time', {}, overwrite=False)
-        self.manifest_json['artifacts']['multi_time'][name] = val
\ No newline at end of file
+        self.manifest_json['artifacts']['multi_time'][name] = val
+
+    def register_frame_store(self, name, val):
+        self.register_artifact('frame_store', {}, overwrite=False)
+        self.manifest_json['artifacts']['frame_store'][name] = val
+
+    def register_proxy_video(self, name, val):
+        self.register_artifact('proxy_video', {}, overwrite=False)
+        self.manifest_json['artifacts']['proxy_video'][name] = val
@@ -0,0 +1,20 @@
+import pandas as pd
+
+
+POSITION_COLUMNS = ['mapped x [px]', 'mapped y [px]']
+
+
+def read_mapped_fixations(path, **kwargs):
+    fixations = pd.read_csv(path, **kwargs)
+
+    # Files written before typed columns were introduced carry positions as "x;y" strings
+    if not set(POSITION_COLUMNS).issubset(fixations.columns) and 'event data' in fixations.columns:
+        positions = fixations['event data'].str.split(';', expand=True).astype(int)
+        fixations['mapped x [px]'] = positions[0]
+        fixations['mapped y [px]'] = positions[1]
+        fixations = fixations.drop(['event data'], axis=1)
+
+    if 'duration [sec]' not in fixations.columns:
+        fixations['duration [sec]'] = fixations['end timestamp [sec]'] - fixations['start timestamp [sec]']
+
+    return fixations
@@ -0,0 +1,49 @@
+import argparse
+import time
+import numpy as np
+
+from utils import SMOOTHING_METHODS
+from benchmark_smoothing import TOLERANCES
+from register_heatmaps_gaze import create_heatmap, create_heatmap_splatting
+
+
+def synthetic_fixations(count, width, height, rng):
+    # Fixations clustered around a few objects on the working area, weighted by duration / 100 ms
+    centers = rng.uniform((.2 * width, .2 * height), (.8 * width, .8 * height), (8, 2))
+    pos = centers[rng.integers(0, len(centers), count)] + rng.normal(0, .05 * height, (count, 2))
+    pos_x = pos[:, 0].astype(int).clip(0, width - 1)
+    pos_y = pos[:, 1].astype(int).clip(0, height - 1)
+    return pos_x, pos_y, rng.uniform(1, 5, count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--kernel_size', type=int, default=211)
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 100, 540, 5000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    size = (args.height, args.width)
+
+    print(f'{"fixations":>9} {"method":>9} {"time [s]":>9} {"max error":>10}')
+    for count in args.counts:
+        pos_x, pos_y, weights = synthetic_fixations(count, args.width, args.height, rng)
+
+        t0 = time.perf_counter()
+        expected = create_heatmap_splatting(pos_x, pos_y, weights, size, kernel_size=args.kernel_size)
+        print(f'{count:>9} {"splatting":>9} {time.perf_counter() - t0:>9.3f} {0:>10.2e}')
+
+        for method in SMOOTHING_METHODS:
+            t0 = time.perf_counter()
+            actual = create_heatmap(pos_x, pos_y, weights, size, kernel_size=args.kernel_size, smoothing=method)
+            elapsed = time.perf_counter() - t0
+
+            # Splatting and smoothing accumulate in a different order, even exact smoothing differs by rounding
+            error = np.abs(actual - expected).max() / expected.max()
+            tolerance = max(TOLERANCES[method], 1e-12)
+            assert actual.shape == expected.shape
+            assert error <= tolerance, f'{method} heatmap exceeds its tolerance ({error:.2e} > {tolerance:.0e})'
+            print(f'{count:>9} {method:>9} {elapsed:>9.3f} {error:>10.2e}')
@@ -0,0 +1,63 @@
+import argparse
+import time
+import cv2 as cv
+import numpy as np
+import hand_detection
+
+from functools import partial
+from itertools import islice
+from pipeline import pipelined, read_frames, detect_hands, track_hands, subtract_background
+
+
+def run(video_path, dsize, max_frames, detect_every, redetect_threshold, model_asset_path):
+    cap = cv.VideoCapture(video_path)
+    back_sub = cv.createBackgroundSubtractorKNN(history=3000, dist2Threshold=1000, detectShadows=False)
+    hand_detector = hand_detection.HandDetector(num_hands=10, model_asset_path=model_asset_path)
+    hand_tracker = hand_detection.HandTracker(hand_detector, detect_every=detect_every, redetect_threshold=redetect_threshold)
+
+    # Full detection on every frame serves as the reference
+    detect = partial(detect_hands, hand_detector) if detect_every == 1 else partial(track_hands, hand_tracker)
+    hand_masks, signal = [], []
+
+    t0 = time.perf_counter()
+    for frame in islice(pipelined(read_frames(cap, dsize), [partial(subtract_background, back_sub), detect], threads=False), max_frames):
+        hand_masks.append(frame['hand_mask'])
+        signal.append(frame['mask'].mean())
+    elapsed = time.perf_counter() - t0
+
+    cap.release()
+    calls = len(signal) if detect_every == 1 else hand_tracker.detector_calls
+    return np.stack(hand_masks), np.array(signal), calls, elapsed
+
+
+def mask_iou(a, b):
+    intersection = (a & b).sum(axis=(1, 2))
+    union = (a | b).sum(axis=(1, 2))
+    # Frames without hands in both masks agree perfectly
+    return np.where(union > 0, intersection / np.maximum(union, 1), 1.)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', type=str, required=True)
+    parser.add_argument('--downsampling_factor', type=float, default=.5)
+    parser.add_argument('--max_frames', type=int, default=3000)
+    parser.add_argument('--detect_every', type=int, nargs='+', default=[2, 5, 10])
+    parser.add_argument('--redetect_threshold', type=float, default=.05)
+    parser.add_argument('--model_asset_path', type=str, default='hand_landmarker_latest.task')
+    args = parser.parse_args()
+
+    cap = cv.VideoCapture(args.video)
+    dsize = (int(round(cap.get(cv.CAP_PROP_FRAME_WIDTH) * args.downsampling_factor)), int(round(cap.get(cv.CAP_PROP_FRAME_HEIGHT) * args.downsampling_factor)))
+    cap.release()
+
+    ref_masks, ref_signal, ref_calls, ref_elapsed = run(args.video, dsize, args.max_frames, 1, args.redetect_threshold, args.model_asset_path)
+
+    print(f'{"detect every":>12} {"calls":>7} {"reduction":>9} {"fps":>7} {"mask IoU":>8} {"corr":>6} {"max diff":>8}')
+    print(f'{1:>12} {ref_calls:>7} {1:>8.1f}x {len(ref_signal) / ref_elapsed:>7.1f} {1:>8.3f} {1:>6.3f} {0:>8.4f}')
+
+    for detect_every in args.detect_every:
+        masks, signal, calls, elapsed = run(args.video, dsize, args.max_frames, detect_every, args.redetect_threshold, args.model_asset_path)
+        corr = np.corrcoef(ref_signal, signal)[0, 1]
+        max_diff = np.abs(ref_signal - signal).max()
+        print(f'{detect_every:>12} {calls:>7} {ref_calls / calls:>8.1f}x {len(signal) / elapsed:>7.1f} {mask_iou(ref_masks, masks).mean():>8.3f} {corr:>6.3f} {max_diff:>8.4f}')
@@ -0,0 +1,57 @@
+import argparse
+import time
+import cv2 as cv
+import numpy as np
+import hand_detection
+
+from functools import partial
+from itertools import islice
+from motion import MOTION_ENGINES, create_background_subtractor, uses_hands
+from pipeline import pipelined, read_frames, detect_hands, skip_hands, subtract_background
+
+
+def run(video_path, dsize, max_frames, engine, model_asset_path):
+    cap = cv.VideoCapture(video_path)
+    stages = [partial(subtract_background, create_background_subtractor(engine))]
+    if uses_hands(engine):
+        hand_detector = hand_detection.HandDetector(num_hands=10, model_asset_path=model_asset_path)
+        stages.append(partial(detect_hands, hand_detector))
+    else:
+        stages.append(skip_hands)
+
+    signal = []
+    t0 = time.perf_counter()
+    for frame in islice(pipelined(read_frames(cap, dsize), stages, threads=False), max_frames):
+        signal.append(frame['mask'].mean())
+    elapsed = time.perf_counter() - t0
+
+    cap.release()
+    return np.array(signal), elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', type=str, required=True)
+    parser.add_argument('--downsampling_factor', type=float, default=.5)
+    parser.add_argument('--max_frames', type=int, default=3000)
+    parser.add_argument('--engines', choices=list(MOTION_ENGINES), nargs='+', default=[e for e in MOTION_ENGINES if e != 'knn+hands'])
+    parser.add_argument('--model_asset_path', type=str, default='hand_landmarker_latest.task')
+    args = parser.parse_args()
+
+    cap = cv.VideoCapture(args.video)
+    dsize = (int(round(cap.get(cv.CAP_PROP_FRAME_WIDTH) * args.downsampling_factor)), int(round(cap.get(cv.CAP_PROP_FRAME_HEIGHT) * args.downsampling_factor)))
+    cap.release()
+
+    # KNN background subtraction restricted to detected hands serves as the reference
+    ref_signal, ref_elapsed = run(args.video, dsize, args.max_frames, 'knn+hands', args.model_asset_path)
+    ref_fps = len(ref_signal) / ref_elapsed
+
+    print(f'{"engine":>10} {"fps":>7} {"speedup":>7} {"corr":>6} {"mean ratio":>10}')
+    print(f'{"knn+hands":>10} {ref_fps:>7.1f} {1:>6.1f}x {1:>6.3f} {1:>10.2f}')
+
+    for engine in args.engines:
+        signal, elapsed = run(args.video, dsize, args.max_frames, engine, args.model_asset_path)
+        fps = len(signal) / elapsed
+        corr = np.corrcoef(ref_signal, signal)[0, 1]
+        mean_ratio = signal.mean() / max(ref_signal.mean(), 1e-12)
+        print(f'{engine:>10} {fps:>7.1f} {fps / ref_fps:>6.1f}x {corr:>6.3f} {mean_ratio:>10.2f}')
@@ -0,0 +1,48 @@
+import argparse
+import time
+import numpy as np
+
+from utils import SMOOTHING_METHODS, smooth
+
+
+# Maximum error relative to the peak of the exact result
+TOLERANCES = {
+    'exact': 0.,
+    'box': .05,
+    'pyramid': .01,
+    'fft': 1e-5,
+}
+
+
+def synthetic_activity(width, height, rng):
+    img = np.zeros((height, width), dtype=np.float32)
+    for _ in range(50):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        img[y: y + rng.integers(10, 120), x: x + rng.integers(10, 120)] += rng.uniform()
+    return img
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--kernel_sizes', type=int, nargs='+', default=[51, 151, 211, 421])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    img = synthetic_activity(args.width, args.height, np.random.default_rng(args.seed))
+
+    print(f'{"kernel":>6} {"mode":>8} {"method":>8} {"time [s]":>9} {"max error":>10}')
+    for kernel_size in args.kernel_sizes:
+        for mode in ('reflect', 'constant'):
+            expected = smooth(img, kernel_size, method='exact', mode=mode)
+
+            for method in SMOOTHING_METHODS:
+                t0 = time.perf_counter()
+                actual = smooth(img, kernel_size, method=method, mode=mode)
+                elapsed = time.perf_counter() - t0
+
+                error = np.abs(actual - expected).max() / expected.max()
+                assert actual.shape == expected.shape
+                assert error <= TOLERANCES[method], f'{method} smoothing exceeds its tolerance ({error:.2e} > {TOLERANCES[method]:.0e})'
+                print(f'{kernel_size:>6} {mode:>8} {method:>8} {elapsed:>9.3f} {error:>10.2e}')
@@ -0,0 +1,64 @@
+import json
+import logging
+import pandas as pd
+
+from pathlib import Path
+
+
+class Checkpoint:
+    def __init__(self, path, config, outputs=()) -> None:
+        self.path = Path(path)
+        # Normalized as stored, e.g. tuples become lists
+        self.config = json.loads(json.dumps(config))
+        self.outputs = [Path(p) for p in outputs]
+
+    def load(self):
+        # State of an interrupted run, only if it was started with the same configuration and its outputs still exist
+        if not self.path.is_file():
+            return None
+
+        missing = [str(p) for p in self.outputs if not p.is_file()]
+        if missing:
+            logging.warning(f'Ignoring checkpoint {self.path}, outputs {missing} of the interrupted run are missing, starting from the beginning')
+            return None
+
+        with open(self.path) as f:
+            checkpoint = json.load(f)
+
+        if checkpoint['config'] != self.config:
+            logging.warning(f'Ignoring checkpoint {self.path} of a run with different settings')
+            return None
+        return checkpoint['state']
+
+    def save(self, state):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'config': self.config, 'state': state}, f, indent=4)
+        tmp_path.replace(self.path)
+
+    def remove(self):
+        self.path.unlink(missing_ok=True)
+
+
+class CsvWriter:
+    # Appends rows to a CSV file in batches. When resuming, everything after the given size in bytes is
+    # discarded, i.e. rows written after the last checkpoint.
+    def __init__(self, path, columns, resume_bytes=None) -> None:
+        self.path = Path(path)
+        self.columns = columns
+        self.rows = []
+
+        if resume_bytes is None:
+            pd.DataFrame(columns=columns).to_csv(self.path, index=False)
+        else:
+            with open(self.path, 'r+b') as f:
+                f.truncate(resume_bytes)
+
+    def append(self, row):
+        self.rows.append(row)
+
+    def flush(self):
+        if self.rows:
+            pd.DataFrame(self.rows, columns=self.columns).to_csv(self.path, mode='a', header=False, index=False)
+            self.rows = []
+        return self.path.stat().st_size
@@ -0,0 +1,118 @@
+import json
+import cv2 as cv
+import numpy as np
+
+from pathlib import Path
+from tqdm import tqdm
+
+
+def reduced_size(width, height, factor):
+    # Processing resolution of a video as (width, height), every script has to agree on it to match frame stores and caches
+    return int(round(width * factor)), int(round(height * factor))
+
+
+def build_frame_store(video_path, out_path, dsize):
+    out_path = Path(out_path)
+    out_path.mkdir(exist_ok=True, parents=True)
+
+    cap = cv.VideoCapture(str(video_path))
+    meta = {
+        'fps': cap.get(cv.CAP_PROP_FPS),
+        'width': int(cap.get(cv.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)),
+        'reduced_width': dsize[0],
+        'reduced_height': dsize[1],
+    }
+
+    # Frames are appended as raw uint8 BGR images, the frame count is only known after decoding
+    msec = []
+    with open(out_path / 'frames.u8', 'wb') as f, tqdm(total=int(cap.get(cv.CAP_PROP_FRAME_COUNT)), unit='frames') as t:
+        while True:
+            ret, img = cap.read()
+            if not ret:
+                break
+
+            f.write(cv.resize(img, dsize=dsize, interpolation=cv.INTER_AREA).tobytes())
+            msec.append(cap.get(cv.CAP_PROP_POS_MSEC))
+            t.update()
+
+    cap.release()
+    np.save(out_path / 'msec.npy', np.array(msec))
+
+    with open(out_path / 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=4)
+    return meta
+
+
+class FrameStore:
+    # Drop-in replacement for the parts of cv.VideoCapture used by the workspace scripts. Frames are returned
+    # at the reduced resolution of the store while the frame size properties refer to the original video.
+    def __init__(self, path) -> None:
+        path = Path(path)
+        with open(path / 'meta.json') as f:
+            self.meta = json.load(f)
+
+        self.msec = np.load(path / 'msec.npy')
+        self.frames = np.memmap(path / 'frames.u8', dtype=np.uint8, mode='r', shape=(len(self.msec), self.meta['reduced_height'], self.meta['reduced_width'], 3))
+        self.pos = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        if prop == cv.CAP_PROP_POS_FRAMES:
+            return float(self.pos)
+        if prop == cv.CAP_PROP_POS_MSEC:
+            return float(self.msec[self.pos - 1]) if self.pos > 0 else 0.
+        if prop == cv.CAP_PROP_FRAME_COUNT:
+            return float(len(self.msec))
+        if prop == cv.CAP_PROP_FPS:
+            return self.meta['fps']
+        if prop == cv.CAP_PROP_FRAME_WIDTH:
+            return float(self.meta['width'])
+        if prop == cv.CAP_PROP_FRAME_HEIGHT:
+            return float(self.meta['height'])
+        return 0.
+
+    def set(self, prop, value):
+        # Seeking by time positions on the first frame at or after the requested timestamp
+        if prop == cv.CAP_PROP_POS_FRAMES:
+            self.pos = int(np.clip(value, 0, len(self.msec)))
+            return True
+        if prop == cv.CAP_PROP_POS_MSEC:
+            self.pos = int(np.searchsorted(self.msec, value))
+            return True
+        return False
+
+    def grab(self):
+        if self.pos >= len(self.msec):
+            return False
+        self.pos += 1
+        return True
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return True, self.frames[self.pos - 1]
+
+    def release(self):
+        pass
+
+
+def open_video(path):
+    # Frame store directories and video files can be used interchangeably
+    if Path(path).is_dir():
+        return FrameStore(path)
+    return cv.VideoCapture(str(path))
+
+
+def video_source(man, name, dsize):
+    video_path = man.get_video(name)['path']
+    try:
+        store = man.get_frame_store(name)
+    except Exception:
+        return video_path
+
+    if (store['width'], store['height']) != tuple(dsize):
+        return video_path
+    return store['path']
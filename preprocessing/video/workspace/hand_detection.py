@@ -1,23 +1,27 @@
-import shapely
 import numpy as np
 import mediapipe as mp
 import cv2 as cv
+from pathlib import Path
 from mediapipe import solutions
 from mediapipe.framework.formats import landmark_pb2
+from utils import file_digest
 
 
-def envelopes_from_landmarks(hand_landmark_list, size):
-    for idx in range(len(hand_landmark_list)):
-        hand_landmarks = hand_landmark_list[idx]
-        points = [(landmark.x*size[1], landmark.y*size[0]) for landmark in hand_landmarks]
-        yield shapely.MultiPoint(points).bounds
+def points_from_landmarks(hand_landmark_list):
+    points = [[(landmark.x, landmark.y) for landmark in hand_landmarks] for hand_landmarks in hand_landmark_list]
+    return np.array(points, dtype=float).reshape(-1, 21, 2)
 
 
-def mask_from_hand_landmarks(detection_result, size):
-    hand_landmark_list = detection_result.hand_landmarks
+def boxes_from_points(points, size):
+    # Bounding boxes (min_x, min_y, max_x, max_y) in pixels of hands given by normalized landmark positions
+    scaled = points * np.array([size[1], size[0]])
+    return np.concatenate((scaled.min(axis=1), scaled.max(axis=1)), axis=1)
+
+
+def mask_from_points(points, size):
     hand_mask = np.zeros(size, dtype=bool)
 
-    for (min_x, min_y, max_x, max_y) in envelopes_from_landmarks(hand_landmark_list, size):
+    for (min_x, min_y, max_x, max_y) in boxes_from_points(points, size):
         hand_mask[int(min_y): int(max_y), int(min_x): int(max_x)] = True
     return hand_mask
 
@@ -85,4 +89,127 @@ class HandDetector:
 
     def detect(self, img, pos_msec):
         img_mp = mp.Image(image_format=mp.ImageFormat.SRGB, data=cv.cvtColor(img, cv.COLOR_BGR2RGB))
-        return self.landmarker.detect_for_video(img_mp, pos_msec)
\ No newline at end of file
+        return self.landmarker.detect_for_video(img_mp, pos_msec)
+
+    def detect_points(self, img, pos_msec):
+        detection_result = self.detect(img, pos_msec)
+        return points_from_landmarks(detection_result.hand_landmarks), detection_result
+
+
+def landmark_cache_path(cache_dir, video_path, model_asset_path, size, roi=None):
+    video_digest = file_digest(video_path, sample_bytes=1 << 23)
+    model_digest = file_digest(model_asset_path)
+
+    # Landmarks detected on cropped frames are relative to the crop (x, y, width, height)
+    crop = '' if roi is None else '_crop{}_{}_{}x{}'.format(*roi)
+    return Path(cache_dir) / f'hands_{video_digest}_{model_digest}_{size[1]}x{size[0]}{crop}.npz'
+
+
+class CachedHandDetector:
+    def __init__(self, cache_path, create_detector) -> None:
+        self.cache_path = Path(cache_path)
+        self.create_detector = create_detector
+        self.hand_detector = None
+        self.new_points = {}
+        self.hits = 0
+
+        # Landmarks of all frames are stored in one array, offsets[i]:offsets[i + 1] are the hands of frame msec[i]
+        self.msec = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.points = np.zeros((0, 21, 2), dtype=np.float32)
+
+        if self.cache_path.is_file():
+            with np.load(self.cache_path) as cached:
+                self.msec, self.offsets, self.points = cached['msec'], cached['offsets'], cached['points']
+
+    def lookup(self, pos_msec):
+        idx = np.searchsorted(self.msec, pos_msec)
+        if idx < len(self.msec) and self.msec[idx] == pos_msec:
+            return self.points[self.offsets[idx]: self.offsets[idx + 1]].astype(float)
+        return None
+
+    def detect_points(self, img, pos_msec):
+        points = self.lookup(pos_msec)
+        if points is not None:
+            self.hits += 1
+            return points, None
+
+        # The landmarker is only created once a frame is missing from the cache
+        if self.hand_detector is None:
+            self.hand_detector = self.create_detector()
+
+        points, detection_result = self.hand_detector.detect_points(img, pos_msec)
+        self.new_points[pos_msec] = points.astype(np.float32)
+        return points, detection_result
+
+    def update(self, new_points):
+        self.new_points.update(new_points)
+
+    def save(self):
+        if not self.new_points:
+            return
+
+        msec = np.concatenate((self.msec, list(self.new_points.keys()))).astype(np.int64)
+        frames = [self.points[self.offsets[idx]: self.offsets[idx + 1]] for idx in range(len(self.msec))] + list(self.new_points.values())
+        order = np.argsort(msec, kind='stable')
+        counts = np.array([len(frames[idx]) for idx in order], dtype=np.int64)
+
+        self.msec = msec[order]
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.points = np.concatenate([frames[idx] for idx in order] + [np.zeros((0, 21, 2), dtype=np.float32)])
+        self.new_points = {}
+
+        # Hand bounding boxes are stored alongside for consumers that do not need the landmarks
+        boxes = np.concatenate((self.points.min(axis=1), self.points.max(axis=1)), axis=1)
+
+        self.cache_path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.cache_path.with_suffix('.tmp.npz')
+        np.savez(tmp_path, msec=self.msec, offsets=self.offsets, points=self.points, boxes=boxes)
+        tmp_path.replace(self.cache_path)
+
+
+class HandTracker:
+    def __init__(self, hand_detector, detect_every=5, redetect_threshold=.05) -> None:
+        self.hand_detector = hand_detector
+        self.detect_every = detect_every
+        self.redetect_threshold = redetect_threshold
+        self.points = np.zeros((0, 21, 2))
+        self.prev_gray = None
+        self.fg_at_detection = 0
+        self.frames_since_detection = 0
+        self.detector_calls = 0
+        self.frames = 0
+
+    def update(self, img, pos_msec, fg_mask=None):
+        fg_fraction = 0 if fg_mask is None else np.count_nonzero(fg_mask) / fg_mask.size
+        self.frames_since_detection += 1
+
+        # Full detection on keyframes and whenever the foreground changed considerably since the last detection
+        redetect = self.frames == 0 or self.frames_since_detection >= self.detect_every
+        redetect = redetect or abs(fg_fraction - self.fg_at_detection) > self.redetect_threshold
+        gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY) if self.detect_every > 1 else None
+
+        if redetect:
+            self.points, detection_result = self.hand_detector.detect_points(img, pos_msec)
+            self.fg_at_detection = fg_fraction
+            self.frames_since_detection = 0
+            self.detector_calls += 1
+        else:
+            detection_result = None
+            self.points = self.track(self.prev_gray, gray, self.points)
+
+        self.prev_gray = gray
+        self.frames += 1
+        return self.points, detection_result
+
+    @staticmethod
+    def track(prev_gray, gray, points):
+        if len(points) == 0:
+            return points
+
+        # Landmarks are moved along the sparse optical flow, points that are lost keep their position
+        size = np.array([gray.shape[1], gray.shape[0]])
+        prev_pts = (points.reshape(-1, 1, 2) * size).astype(np.float32)
+        next_pts, status, _ = cv.calcOpticalFlowPyrLK(prev_gray, gray, prev_pts, None, winSize=(21, 21), maxLevel=3)
+        next_pts = np.where(status[..., None] == 1, next_pts, prev_pts)
+        return (next_pts.reshape(points.shape) / size).clip(0, 1)
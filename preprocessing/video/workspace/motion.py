@@ -0,0 +1,54 @@
+import cv2 as cv
+import numpy as np
+
+
+class RunningAverageSubtractor:
+    # Pixels whose gray value differs from an exponential running average of the previous frames are foreground.
+    # Masks use the OpenCV convention, 255 for foreground and 0 for background.
+    def __init__(self, history=3000, threshold=30) -> None:
+        self.alpha = 1 / history
+        self.threshold = threshold
+        self.background = None
+
+    def apply(self, img):
+        gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY).astype(np.float32)
+        if self.background is None:
+            self.background = gray.copy()
+
+        fg_mask = cv.absdiff(gray, self.background) > self.threshold
+        cv.accumulateWeighted(gray, self.background, self.alpha)
+        return fg_mask.astype(np.uint8) * 255
+
+
+class NoBackgroundSubtractor:
+    # Every pixel is foreground, movement is then given by the hand masks alone
+    def apply(self, img):
+        return np.full(img.shape[:2], 255, dtype=np.uint8)
+
+
+BACKGROUND_MODELS = {
+    'knn': lambda history: cv.createBackgroundSubtractorKNN(history=history, dist2Threshold=1000, detectShadows=False),
+    'mog2': lambda history: cv.createBackgroundSubtractorMOG2(history=history, varThreshold=16, detectShadows=False),
+    'diff': lambda history: RunningAverageSubtractor(history=history),
+    'none': lambda history: NoBackgroundSubtractor(),
+}
+
+
+# Background model of each engine and whether movement is restricted to detected hands
+MOTION_ENGINES = {
+    'knn+hands': ('knn', True),
+    'mog2+hands': ('mog2', True),
+    'diff+hands': ('diff', True),
+    'hands': ('none', True),
+    'knn': ('knn', False),
+    'mog2': ('mog2', False),
+    'diff': ('diff', False),
+}
+
+
+def create_background_subtractor(engine, history=3000):
+    return BACKGROUND_MODELS[MOTION_ENGINES[engine][0]](history)
+
+
+def uses_hands(engine):
+    return MOTION_ENGINES[engine][1]
@@ -0,0 +1,158 @@
+import queue
+import threading
+import cv2 as cv
+import numpy as np
+import hand_detection
+
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(source, out_queue, stop):
+    try:
+        for item in source:
+            if not _put(out_queue, item, stop):
+                return
+    except Exception as e:
+        _put(out_queue, _Failure(e), stop)
+        return
+    _put(out_queue, _DONE, stop)
+
+
+def _transform(fn, in_queue, out_queue, stop):
+    while not stop.is_set():
+        try:
+            item = in_queue.get(timeout=.1)
+        except queue.Empty:
+            continue
+
+        if item is _DONE or isinstance(item, _Failure):
+            _put(out_queue, item, stop)
+            return
+
+        try:
+            item = fn(item)
+        except Exception as e:
+            _put(out_queue, _Failure(e), stop)
+            return
+
+        if not _put(out_queue, item, stop):
+            return
+
+
+def pipelined(source, stages, queue_size=8, threads=True):
+    # Without threads all stages run one after another in the calling thread
+    if not threads:
+        for item in source:
+            for fn in stages:
+                item = fn(item)
+            yield item
+        return
+
+    # One thread per stage, connected by bounded FIFO queues so item order is kept
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    workers = [threading.Thread(target=_produce, args=(source, queues[0], stop), daemon=True)]
+    workers += [threading.Thread(target=_transform, args=(fn, queues[idx], queues[idx + 1], stop), daemon=True) for idx, fn in enumerate(stages)]
+
+    for worker in workers:
+        worker.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+
+def read_frames(cap, dsize, end_frame=None, stride=1, skipped=None):
+    while end_frame is None or cap.get(cv.CAP_PROP_POS_FRAMES) < end_frame:
+        # Frames between samples are only grabbed, not decoded. Their positions are collected in skipped.
+        if int(cap.get(cv.CAP_PROP_POS_FRAMES)) % stride != 0:
+            if not cap.grab():
+                return
+            if skipped is not None:
+                skipped.append((int(cap.get(cv.CAP_PROP_POS_FRAMES)), int(cap.get(cv.CAP_PROP_POS_MSEC))))
+            continue
+
+        ret, img = cap.read()
+        if not ret:
+            return
+
+        # Frames from a frame store already have the target size
+        if img.shape[1] != dsize[0] or img.shape[0] != dsize[1]:
+            img = cv.resize(img, dsize=dsize, interpolation=cv.INTER_AREA)
+
+        yield {
+            'frame': int(cap.get(cv.CAP_PROP_POS_FRAMES)),
+            'msec': int(cap.get(cv.CAP_PROP_POS_MSEC)),
+            'img': img,
+        }
+
+
+def crop_frame(roi, frame):
+    # Later stages only see the region (x, y, width, height) of the frame
+    x, y, w, h = roi
+    frame['frame_size'] = frame['img'].shape[:2]
+    frame['img'] = np.ascontiguousarray(frame['img'][y: y + h, x: x + w])
+    return frame
+
+
+def uncrop_masks(roi, frame):
+    # Masks of a cropped frame are placed back into the full frame, pixels outside the crop are background
+    x, y, w, h = roi
+    for key in ('fg_mask', 'hand_mask', 'mask'):
+        mask = np.zeros(frame['frame_size'], dtype=bool)
+        mask[y: y + h, x: x + w] = frame[key]
+        frame[key] = mask
+    return frame
+
+
+def subtract_background(back_sub, frame):
+    frame['fg_mask'] = back_sub.apply(frame['img']) == 255
+    return frame
+
+
+def detect_hands(hand_detector, frame):
+    points, frame['detection'] = hand_detector.detect_points(frame['img'], frame['msec'])
+    frame['hand_mask'] = hand_detection.mask_from_points(points, frame['img'].shape[:2])
+    frame['mask'] = frame['fg_mask'] & frame['hand_mask']
+    return frame
+
+
+def track_hands(hand_tracker, frame):
+    # Runs the detector on keyframes only, see hand_detection.HandTracker
+    points, frame['detection'] = hand_tracker.update(frame['img'], frame['msec'], frame['fg_mask'])
+    frame['hand_mask'] = hand_detection.mask_from_points(points, frame['img'].shape[:2])
+    frame['mask'] = frame['fg_mask'] & frame['hand_mask']
+    return frame
+
+
+def skip_hands(frame):
+    # Motion engines without hand detection count all foreground pixels
+    frame['detection'] = None
+    frame['hand_mask'] = np.ones(frame['fg_mask'].shape, dtype=bool)
+    frame['mask'] = frame['fg_mask']
+    return frame
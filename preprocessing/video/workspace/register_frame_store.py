@@ -0,0 +1,34 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import argparse
+import logging
+import cv2 as cv
+
+from pathlib import Path
+from frame_store import build_frame_store, reduced_size
+from manifest_manager import ManifestManager
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', type=Path, required=True)
+    parser.add_argument('--out_dir', type=Path, required=True)
+    parser.add_argument('--downsampling_factor', type=float, default=.5)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+
+    with ManifestManager(args.manifest) as man:
+        video_path = man.get_video('workspace')['path']
+
+        cap = cv.VideoCapture(video_path)
+        reduced_width, reduced_height = reduced_size(int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)), args.downsampling_factor)
+        cap.release()
+
+        out_path = args.out_dir / f'frames_{reduced_width}x{reduced_height}'
+        build_frame_store(video_path, out_path, (reduced_width, reduced_height))
+
+        man.register_frame_store('workspace', {'path': str(out_path), 'width': reduced_width, 'height': reduced_height})
+        logging.info('Registered "frame_store/workspace" as an global artifact')
@@ -13,7 +13,9 @@ import logging
 from tqdm import tqdm
 from pathlib import Path
 from utils import *
+from checkpoint import Checkpoint
 from manifest_manager import ManifestManager
+from mapped_fixations import read_mapped_fixations
 
 
 def create_heatmap_splatting(pos_x, pos_y, weights, size, kernel_size=151):
@@ -30,48 +32,109 @@ def create_heatmap_splatting(pos_x, pos_y, weights, size, kernel_size=151):
     return heatmap
 
 
-def fix_in_range(recordings, from_time_sec, to_time_sec):
-    fix_pos_x = []
-    fix_pos_y = []
-    fix_dur_ms = []
+def create_heatmap_histogram(pos_x, pos_y, weights, size, kernel_size=151, smoothing='fft'):
+    # Weighted fixations are binned into one pixel histogram that is smoothed once, kernels extending beyond the frame are cut off
+    height, width = size
+    heatmap = np.bincount((pos_y * width + pos_x).astype(int), weights=weights, minlength=height * width).astype(float, copy=False).reshape(size)
+    return smooth(heatmap, kernel_size, method=smoothing, mode='constant')
+
+
+def smoothing_cost(height, width, kernel_size, smoothing):
+    # Rough cost of smoothing an image in units of kernel elements added when splatting, measured at 4K with a 211 px kernel
+    per_pixel = {'exact': kernel_size / 3, 'fft': 32, 'box': 32, 'pyramid': 8}[smoothing]
+    return height * width * per_pixel
+
+
+def create_heatmap(pos_x, pos_y, weights, size, kernel_size=151, smoothing='fft'):
+    heatmap = np.zeros(size)
+    if len(pos_x) == 0:
+        return heatmap
+
+    # Only the bounding box of the fixations, padded by the kernel radius, can be nonzero
+    height, width = size
+    ksh = kernel_size // 2
+    x0, x1 = max(pos_x.min() - ksh, 0), min(pos_x.max() + ksh + 1, width)
+    y0, y1 = max(pos_y.min() - ksh, 0), min(pos_y.max() + ksh + 1, height)
 
+    # Each window uses whatever is cheaper, splatting n kernels or smoothing the histogram of the bounding box
+    if len(pos_x) * kernel_size**2 <= smoothing_cost(y1 - y0, x1 - x0, kernel_size, smoothing):
+        return create_heatmap_splatting(pos_x, pos_y, weights, size, kernel_size=kernel_size)
+
+    heatmap[y0: y1, x0: x1] = create_heatmap_histogram(pos_x - x0, pos_y - y0, weights, (y1 - y0, x1 - x0), kernel_size=kernel_size, smoothing=smoothing)
+    return heatmap
+
+
+def load_fixations(recordings):
+    fixations = []
+
+    # Every table is read once and sorted by start time so windows can be found by binary search
     for rec in recordings:
         if 'mapped_fixations' not in rec['artifacts']:
             continue
 
-        surface_fix = pd.read_csv(rec['artifacts']['mapped_fixations']['path'])
-        surface_fix['duration [ms]'] = 1e3 * (surface_fix['end timestamp [sec]'] - surface_fix['start timestamp [sec]'])
+        surface_fix = read_mapped_fixations(rec['artifacts']['mapped_fixations']['path'])
+        surface_fix = surface_fix.sort_values('start timestamp [sec]', kind='stable')
 
-        within_range = (surface_fix['start timestamp [sec]'] >= from_time_sec) & (surface_fix['end timestamp [sec]'] <= to_time_sec) 
-        surface_fix = surface_fix[within_range]
+        fixations.append({
+            'start': surface_fix['start timestamp [sec]'].to_numpy(),
+            'end': surface_fix['end timestamp [sec]'].to_numpy(),
+            'pos_x': surface_fix['mapped x [px]'].to_numpy().astype(int),
+            'pos_y': surface_fix['mapped y [px]'].to_numpy().astype(int),
+            'dur_ms': (1e3 * surface_fix['duration [sec]']).to_numpy().astype(int),
+        })
+    return fixations
 
-        dur_ms = surface_fix['duration [ms]'].astype(int)
-        pos_x = surface_fix['event data'].map(lambda d: int(d.split(';')[0]))
-        pos_y = surface_fix['event data'].map(lambda d: int(d.split(';')[1]))
 
-        fix_pos_x.extend(pos_x)
-        fix_pos_y.extend(pos_y)
-        fix_dur_ms.extend(dur_ms)
+def fix_in_range(fixations, from_time_sec, to_time_sec):
+    fix_pos_x = []
+    fix_pos_y = []
+    fix_dur_ms = []
+
+    for fix in fixations:
+        lo = np.searchsorted(fix['start'], from_time_sec, side='left')
+        hi = np.searchsorted(fix['start'], to_time_sec, side='right')
+        within_range = fix['end'][lo:hi] <= to_time_sec
 
-    fix_pos_x = np.array(fix_pos_x)
-    fix_pos_y = np.array(fix_pos_y)
-    fix_dur_ms = np.array(fix_dur_ms)
+        fix_pos_x.append(fix['pos_x'][lo:hi][within_range])
+        fix_pos_y.append(fix['pos_y'][lo:hi][within_range])
+        fix_dur_ms.append(fix['dur_ms'][lo:hi][within_range])
 
-    return fix_pos_x, fix_pos_y, fix_dur_ms
+    if not fixations:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return np.concatenate(fix_pos_x), np.concatenate(fix_pos_y), np.concatenate(fix_dur_ms)
 
     
-def gaze_heatmap(cap, recordings, start_timestamps, end_timestamps, kernel_size):
+def save_fixation_points(path, fixations, size, kernel_size):
+    # All fixations in one columnar table sorted by start time, heatmaps are rasterized from it on demand
+    columns = {key: np.concatenate([fix[key] for fix in fixations]) if fixations else np.zeros(0) for key in ('start', 'end', 'pos_x', 'pos_y', 'dur_ms')}
+    order = np.argsort(columns['start'], kind='stable')
+
+    np.savez_compressed(
+        path,
+        start=columns['start'][order],
+        end=columns['end'][order],
+        pos_x=columns['pos_x'][order].clip(0, size[1] - 1).astype(np.int32),
+        pos_y=columns['pos_y'][order].clip(0, size[0] - 1).astype(np.int32),
+        weight=(columns['dur_ms'][order] / 100).astype(np.float32),
+        size=np.array(size),
+        kernel_size=kernel_size,
+    )
+
+
+def gaze_heatmap(cap, recordings, start_timestamps, end_timestamps, kernel_size, smoothing='fft', first_window=0):
     frame_width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH)) 
     frame_height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+    fixations = load_fixations(recordings)
 
-    for start_ts, end_ts in zip(start_timestamps, end_timestamps):
-        fix_pos_x, fix_pos_y, fix_dur_ms = fix_in_range(recordings, start_ts, end_ts)
+    # Windows are independent of each other, resuming needs no warm-up
+    for start_ts, end_ts in zip(start_timestamps[first_window:], end_timestamps[first_window:]):
+        fix_pos_x, fix_pos_y, fix_dur_ms = fix_in_range(fixations, start_ts, end_ts)
 
         fix_pos_x = fix_pos_x.clip(0, frame_width-1)
         fix_pos_y = fix_pos_y.clip(0, frame_height-1)
         weights = fix_dur_ms / 100
 
-        yield create_heatmap_splatting(fix_pos_x, fix_pos_y, weights, (frame_height, frame_width), kernel_size=kernel_size) 
+        yield create_heatmap(fix_pos_x, fix_pos_y, weights, (frame_height, frame_width), kernel_size=kernel_size, smoothing=smoothing)
 
     cap.release()
 
@@ -81,40 +144,67 @@ if __name__ == '__main__':
     parser.add_argument('--manifest', type=Path, required=True)
     parser.add_argument('--delta_step_sec', type=float, required=False, default=30.)
     parser.add_argument('--kernel_size', type=int, required=False, default=211)
+    parser.add_argument('--smoothing', choices=list(SMOOTHING_METHODS), default='fft')
+    parser.add_argument('--pyramid_levels', type=int, default=3)
+    parser.add_argument('--compress', action='store_true')
     parser.add_argument('--out_dir', type=Path, required=True)
     parser.add_argument('--show_output', action='store_true')
+    parser.add_argument('--points', action='store_true')
+    parser.add_argument('--resume', action='store_true')
     args = parser.parse_args()
 
     logging.getLogger().setLevel(logging.INFO)
 
     with ManifestManager(args.manifest) as man:
         root_dir = args.out_dir
-        out_dir = root_dir / 'gaze'
-        out_dir.mkdir(exist_ok=True, parents=True)
 
         cap = cv.VideoCapture(man.get_video('workspace')['path'])
         dur_sec = int(cap.get(cv.CAP_PROP_FRAME_COUNT) / cap.get(cv.CAP_PROP_FPS)) 
 
         start_timestamps = np.arange(0, dur_sec, args.delta_step_sec)
         end_timestamps = start_timestamps + args.delta_step_sec
-        filenames = [f'gaze/{n:04d}.npy' for n in range(len(start_timestamps))]
-        heatmaps = gaze_heatmap(cap, man.get_recordings(), start_timestamps, end_timestamps, kernel_size=args.kernel_size)
-
-        df = pd.DataFrame(data=zip(filenames, start_timestamps, end_timestamps), columns=('filename', 'start timestamp [sec]', 'end timestamp [sec]'))
-        df.to_csv(root_dir / 'gaze.csv', index=False)
-
-        with tqdm(total=len(start_timestamps), desc='compute heatmaps', unit='heatmap') as t:
-            for heatmap, filename in zip(heatmaps, filenames):
-                heatmap = heatmap.astype(np.float16)
-                np.save(root_dir / filename, heatmap)
-
-                if args.show_output:
-                    img = create_heatmap_img(heatmap, colormap=cm.get_cmap('plasma', 9))
-                    cv.imshow('heatmap', img)
-                    key = cv.waitKey(1)
-                    if key & 0xff == ord('q'):
-                        break
-                t.update()
-
-        man.register_video_overlay('attention', {'path': str(args.out_dir / 'gaze.csv')})
-        logging.info('Registered "video_overlay/attention" as an global artifact')
\ No newline at end of file
+        frame_size = (int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv.CAP_PROP_FRAME_WIDTH)))
+
+        if args.points:
+            cap.release()
+            save_fixation_points(root_dir / 'gaze_points.npz', load_fixations(man.get_recordings()), frame_size, args.kernel_size)
+            overlay = {'path': str(args.out_dir / 'gaze_points.npz'), 'type': 'points'}
+        else:
+            config = {'video': man.get_video('workspace')['path'], 'delta_step_sec': args.delta_step_sec, 'kernel_size': args.kernel_size, 'smoothing': args.smoothing, 'pyramid_levels': args.pyramid_levels, 'compress': args.compress}
+            checkpoint = Checkpoint(root_dir / 'gaze.checkpoint.json', config, outputs=HeatmapStackWriter.level_paths(root_dir / 'gaze.stack', args.pyramid_levels))
+            state = checkpoint.load() if args.resume else None
+            first_window = 0 if state is None else state['window']
+            if state is not None:
+                logging.info(f'Resuming at window {first_window}/{len(start_timestamps)}')
+
+            writer = HeatmapStackWriter(root_dir / 'gaze.stack', len(start_timestamps), frame_size, levels=args.pyramid_levels, compress=args.compress, resume=state is not None)
+            heatmaps = gaze_heatmap(cap, man.get_recordings(), start_timestamps, end_timestamps, kernel_size=args.kernel_size, smoothing=args.smoothing, first_window=first_window)
+
+            df = pd.DataFrame(data=zip(start_timestamps, end_timestamps), columns=('start timestamp [sec]', 'end timestamp [sec]'))
+            df.insert(0, 'filename', 'gaze.stack')
+            df.insert(1, 'index', np.arange(len(df.index)))
+            df.to_csv(root_dir / 'gaze.csv', index=False)
+
+            complete = False
+            with tqdm(total=len(start_timestamps), initial=first_window, desc='compute heatmaps', unit='heatmap') as t:
+                for idx, heatmap in enumerate(heatmaps, start=first_window):
+                    heatmap = heatmap.astype(np.float16)
+                    writer.write(idx, heatmap)
+                    writer.flush()
+                    checkpoint.save({'window': idx + 1})
+
+                    if args.show_output:
+                        img = create_heatmap_img(heatmap, colormap=cm.get_cmap('plasma', 9))
+                        cv.imshow('heatmap', img)
+                        key = cv.waitKey(1)
+                        if key & 0xff == ord('q'):
+                            break
+                    t.update()
+                else:
+                    checkpoint.remove()
+                    complete = True
+            writer.close(complete=complete)
+            overlay = {'path': str(args.out_dir / 'gaze.csv')}
+
+        man.register_video_overlay('attention', overlay)
+        logging.info('Registered "video_overlay/attention" as an global artifact')
@@ -12,26 +12,35 @@ import json
 import hand_detection
 
 from matplotlib import cm
+from contextlib import closing
+from functools import partial
 from tqdm import tqdm
-from scipy.ndimage import correlate1d
 from pathlib import Path
-from utils import gaussian_kernel_1d, get_merged_aois_masks, get_aois, create_heatmap_img
+from utils import SMOOTHING_METHODS, HeatmapStackWriter, smooth, get_aoi_rasters, crop_box, create_heatmap_img, file_digest
+from frame_store import open_video, video_source, reduced_size
+from checkpoint import Checkpoint
+from motion import MOTION_ENGINES, create_background_subtractor, uses_hands
 from manifest_manager import ManifestManager
 
 
-def mean_activity(cap, hand_detector, back_sub, aoi_mask, start_msec, end_msec, downscale_factor=.5, show_output=True):
+def mean_activity(cap, hand_tracker, back_sub, aoi_mask, start_msec, end_msec, downscale_factor=.5, show_output=True, roi=None):
     cap.set(cv.CAP_PROP_POS_MSEC, start_msec)
     pos_msec = start_msec
 
     width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH)) 
     height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
 
-    reduced_width = int(width * downscale_factor) 
-    reduced_height = int(height * downscale_factor)
+    reduced_width, reduced_height = reduced_size(width, height, downscale_factor)
 
-    accu = np.zeros((height, width))
+    # Masks are accumulated in place at the processing resolution and only the mean is upsampled
+    accu = np.zeros((reduced_height, reduced_width), dtype=np.float32)
     count = 0
 
+    # Only the region of interest (x, y, width, height) is processed, pixels outside of it are never active
+    x, y, w, h = (0, 0, reduced_width, reduced_height) if roi is None else roi
+    roi_accu = accu[y: y + h, x: x + w]
+    roi_aoi_mask = aoi_mask[y: y + h, x: x + w]
+
     while pos_msec < end_msec:
         ret, img = cap.read()
         pos_msec = int(cap.get(cv.CAP_PROP_POS_MSEC))
@@ -40,46 +49,67 @@ def mean_activity(cap, hand_detector, back_sub, aoi_mask, start_msec, end_msec,
             print('EOF')
             break
 
-        img = cv.resize(img, dsize=(reduced_width, reduced_height), interpolation=cv.INTER_AREA)
-
-        detection_result = hand_detector.detect(img, pos_msec)
-        hand_mask = hand_detection.mask_from_hand_landmarks(detection_result, img.shape[:2])
+        # Frames from a frame store already have the target size
+        if img.shape[1] != reduced_width or img.shape[0] != reduced_height:
+            img = cv.resize(img, dsize=(reduced_width, reduced_height), interpolation=cv.INTER_AREA)
+        img = np.ascontiguousarray(img[y: y + h, x: x + w])
 
-        fg_mask = back_sub.apply(img)
-        frame_mask = (fg_mask == 255) & hand_mask
-        frame_mask = frame_mask * aoi_mask
+        fg_mask = back_sub.apply(img) == 255
+        frame_mask = fg_mask & roi_aoi_mask
+        detection_result = None
 
-        frame_mask = cv.resize(frame_mask.astype(float), dsize=(width, height), interpolation=cv.INTER_AREA)
-        accu = accu + frame_mask
+        # Without a hand tracker, i.e. for motion engines without hand detection, all foreground counts
+        if hand_tracker is not None:
+            points, detection_result = hand_tracker.update(img, pos_msec, fg_mask)
+            frame_mask &= hand_detection.mask_from_points(points, img.shape[:2])
+        roi_accu += frame_mask
         count += 1
 
         if show_output:
-            cv.imshow('FG Mask', cv.resize((255*frame_mask).astype(np.uint8), fx=0.5, fy=0.5, dsize=None, interpolation=cv.INTER_AREA))    
-            cv.imshow('Hand Landmarks', hand_detection.draw_landmarks_on_image(img, detection_result))    
+            cv.imshow('FG Mask', (255*frame_mask).astype(np.uint8))
+            if detection_result is not None:
+                cv.imshow('Hand Landmarks', hand_detection.draw_landmarks_on_image(img, detection_result))
             cv.imshow('frame', img)
             cv.waitKey(1)
 
     cv.destroyAllWindows()
-    return accu / count
+    accu /= count
+    return cv.resize(accu, dsize=(width, height), interpolation=cv.INTER_AREA)
 
 
-def activity_heatmap(cap, aois, start_timestamps, end_timestamps, kernel_size, downscale_factor, show_output):
-    kernel_1d = gaussian_kernel_1d(kernel_size)
+def activity_heatmap(cap, aoi_path, start_timestamps, end_timestamps, kernel_size, downscale_factor, show_output, cache_dir=None, detect_every=1, redetect_threshold=.05, landmark_cache=None, smoothing='exact', first_window=0, warmup_sec=60., engine='knn+hands', roi=None):
 
     width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH)) 
     height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
 
-    back_sub = cv.createBackgroundSubtractorKNN(history=3000, dist2Threshold=1000, detectShadows=False)
-    hand_detector = hand_detection.HandDetector(num_hands=10, model_asset_path='hand_landmarker_latest.task')
+    back_sub = create_background_subtractor(engine, history=3000)
+    hand_detector, hand_tracker = None, None
+    if uses_hands(engine):
+        create_detector = partial(hand_detection.HandDetector, num_hands=10, model_asset_path='hand_landmarker_latest.task')
+        hand_detector = create_detector() if landmark_cache is None else hand_detection.CachedHandDetector(landmark_cache, create_detector)
+        hand_tracker = hand_detection.HandTracker(hand_detector, detect_every=detect_every, redetect_threshold=redetect_threshold)
+
+    reduced_width, reduced_height = reduced_size(width, height, downscale_factor)
+
+    aoi_mask = get_aoi_rasters(aoi_path, reduced_width, reduced_height, scale=downscale_factor, cache_dir=cache_dir)['hull_mask']
 
-    aoi_mask = get_merged_aois_masks(aois, width, height)
-    aoi_mask = cv.resize(aoi_mask, fx=downscale_factor, fy=downscale_factor, dsize=None)
+    # Landmarks detected so far are also kept if the caller stops early or an error occurs
+    try:
+        # When resuming, the preceding windows within warmup_sec are replayed to warm up background subtraction and tracking
+        resume_sec = start_timestamps[first_window] if first_window < len(start_timestamps) else np.inf
+        for start_ts, end_ts in zip(start_timestamps[:first_window], end_timestamps[:first_window]):
+            if start_ts >= resume_sec - warmup_sec:
+                mean_activity(cap, hand_tracker, back_sub, aoi_mask, int(start_ts * 1e3), int(end_ts * 1e3), downscale_factor=downscale_factor, show_output=show_output, roi=roi)
 
-    for start_ts, end_ts in zip(start_timestamps, end_timestamps):
-        activity = mean_activity(cap, hand_detector, back_sub, aoi_mask, int(start_ts * 1e3), int(end_ts * 1e3), downscale_factor=downscale_factor, show_output=show_output)
-        temp = correlate1d(activity, weights=kernel_1d, axis=0, mode='reflect')
-        yield correlate1d(temp, weights=kernel_1d, axis=1, mode='reflect')
-    cap.release()
+        for start_ts, end_ts in zip(start_timestamps[first_window:], end_timestamps[first_window:]):
+            activity = mean_activity(cap, hand_tracker, back_sub, aoi_mask, int(start_ts * 1e3), int(end_ts * 1e3), downscale_factor=downscale_factor, show_output=show_output, roi=roi)
+            yield smooth(activity, kernel_size, method=smoothing)
+    finally:
+        cap.release()
+
+        if isinstance(hand_detector, hand_detection.CachedHandDetector):
+            logging.info(f'Adding hand landmarks of {len(hand_detector.new_points)} frames to {landmark_cache}')
+            hand_detector.save()
 
 
 
@@ -88,35 +118,79 @@ if __name__ == '__main__':
     parser.add_argument('--manifest', type=Path, required=True)
     parser.add_argument('--delta_step_sec', type=float, required=False, default=30.)
     parser.add_argument('--kernel_size', type=int, required=False, default=211)
+    parser.add_argument('--smoothing', choices=list(SMOOTHING_METHODS), default='exact')
+    parser.add_argument('--pyramid_levels', type=int, default=3)
+    parser.add_argument('--compress', action='store_true')
     parser.add_argument('--out_dir', type=Path, required=True)
     parser.add_argument('--show_output', action='store_true')
+    parser.add_argument('--engine', choices=list(MOTION_ENGINES), default='knn+hands')
+    parser.add_argument('--detect_every', type=int, default=1)
+    parser.add_argument('--redetect_threshold', type=float, default=.05)
+    parser.add_argument('--no_landmark_cache', action='store_true')
+    parser.add_argument('--crop_to_aois', action='store_true')
+    parser.add_argument('--crop_padding', type=int, default=64)
+    parser.add_argument('--warmup_sec', type=float, default=60.)
+    parser.add_argument('--resume', action='store_true')
     args = parser.parse_args()
 
     logging.getLogger().setLevel(logging.INFO)
 
     with ManifestManager(args.manifest) as man:
         root_dir = args.out_dir
-        out_dir = root_dir / 'move'
-        out_dir.mkdir(exist_ok=True, parents=True)
 
-        aois = get_aois(man.get_areas_of_interests()['path'])
+        aoi_path = man.get_areas_of_interests()['path']
 
-        cap = cv.VideoCapture(man.get_video('workspace')['path'])
+        video_path = man.get_video('workspace')['path']
+        cap = cv.VideoCapture(video_path)
         dur_sec = int(cap.get(cv.CAP_PROP_FRAME_COUNT) / cap.get(cv.CAP_PROP_FPS)) 
 
         start_timestamps = np.arange(0, dur_sec, args.delta_step_sec)
         end_timestamps = start_timestamps + args.delta_step_sec - 1e-1
 
-        filenames = [f'move/{n:04d}.npy' for n in range(len(start_timestamps))]
-        heatmaps = activity_heatmap(cap, aois, start_timestamps, end_timestamps, kernel_size=args.kernel_size, downscale_factor=.5, show_output=args.show_output)
-
-        df = pd.DataFrame(data=zip(filenames, start_timestamps, end_timestamps), columns=('filename', 'start timestamp [sec]', 'end timestamp [sec]'))
-        #df.to_csv(root_dir / 'move.csv', index=False)
-
-        with tqdm(total=len(start_timestamps), desc='compute heatmaps', unit='heatmap') as t:
-            for heatmap, filename in zip(heatmaps, filenames):
+        downscale_factor = .5
+        reduced_width, reduced_height = reduced_size(int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)), downscale_factor)
+
+        # Frames can be cropped to the padded bounding box of the AOI hull, the padding is given at video resolution
+        roi = None
+        if args.crop_to_aois:
+            roi = crop_box(get_aoi_rasters(aoi_path, reduced_width, reduced_height, scale=downscale_factor, cache_dir=root_dir)['hull_mask'], int(args.crop_padding * downscale_factor))
+            logging.info(f'Cropping frames to {roi[2]}x{roi[3]} at ({roi[0]}, {roi[1]}), {roi[2] * roi[3] / (reduced_width * reduced_height):.0%} of the pixels')
+
+        # Every finished window is on disk, the checkpoint records how many of them
+        config = {'video': video_path, 'aois': file_digest(aoi_path), 'delta_step_sec': args.delta_step_sec, 'kernel_size': args.kernel_size, 'smoothing': args.smoothing, 'pyramid_levels': args.pyramid_levels, 'compress': args.compress, 'engine': args.engine, 'roi': roi, 'detect_every': args.detect_every, 'redetect_threshold': args.redetect_threshold}
+        checkpoint = Checkpoint(root_dir / 'move.checkpoint.json', config, outputs=HeatmapStackWriter.level_paths(root_dir / 'move.stack', args.pyramid_levels))
+        state = checkpoint.load() if args.resume else None
+        first_window = 0 if state is None else state['window']
+        if state is not None:
+            logging.info(f'Resuming at window {first_window}/{len(start_timestamps)}')
+
+        frame_size = (int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv.CAP_PROP_FRAME_WIDTH)))
+        writer = HeatmapStackWriter(root_dir / 'move.stack', len(start_timestamps), frame_size, levels=args.pyramid_levels, compress=args.compress, resume=state is not None)
+        landmark_cache = None
+        if not args.no_landmark_cache and uses_hands(args.engine):
+            landmark_cache = hand_detection.landmark_cache_path(root_dir, video_path, 'hand_landmarker_latest.task', (reduced_height, reduced_width), roi=roi)
+
+        # Frames are read from a registered frame store if it matches the processing resolution
+        source_path = video_source(man, 'workspace', (reduced_width, reduced_height))
+        if source_path != video_path:
+            logging.info(f'Reading frames from frame store {source_path}')
+            cap.release()
+            cap = open_video(source_path)
+
+        heatmaps = activity_heatmap(cap, aoi_path, start_timestamps, end_timestamps, kernel_size=args.kernel_size, downscale_factor=downscale_factor, show_output=args.show_output, cache_dir=root_dir, detect_every=args.detect_every, redetect_threshold=args.redetect_threshold, landmark_cache=landmark_cache, smoothing=args.smoothing, first_window=first_window, warmup_sec=args.warmup_sec, engine=args.engine, roi=roi)
+
+        df = pd.DataFrame(data=zip(start_timestamps, end_timestamps), columns=('start timestamp [sec]', 'end timestamp [sec]'))
+        df.insert(0, 'filename', 'move.stack')
+        df.insert(1, 'index', np.arange(len(df.index)))
+        df.to_csv(root_dir / 'move.csv', index=False)
+
+        complete = False
+        with tqdm(total=len(start_timestamps), initial=first_window, desc='compute heatmaps', unit='heatmap') as t, closing(heatmaps):
+            for idx, heatmap in enumerate(heatmaps, start=first_window):
                 heatmap = heatmap.astype(np.float16)
-                np.save(root_dir / filename, heatmap)
+                writer.write(idx, heatmap)
+                writer.flush()
+                checkpoint.save({'window': idx + 1})
 
                 if args.show_output:
                     img = create_heatmap_img(heatmap, colormap=cm.get_cmap('plasma', 9))
@@ -126,6 +200,10 @@ if __name__ == '__main__':
                     if key & 0xff == ord('q'):
                         break
                 t.update()
+            else:
+                checkpoint.remove()
+                complete = True
+        writer.close(complete=complete)
 
         man.register_video_overlay('movement', {'path': str(args.out_dir / 'move.csv')})
         logging.info('Registered "video_overlay/movement" as an global artifact')
\ No newline at end of file
@@ -8,13 +8,137 @@ import numpy as np
 import argparse
 import hand_detection
 import logging
+import time
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import partial
 from pathlib import Path
 from tqdm import tqdm
-from utils import get_aois, get_masks
+from pipeline import pipelined, read_frames, crop_frame, uncrop_masks, detect_hands, track_hands, skip_hands, subtract_background
+from utils import get_aois, get_masks, get_aoi_rasters, crop_box, file_digest
+from frame_store import open_video, video_source, reduced_size
+from checkpoint import Checkpoint, CsvWriter
+from motion import MOTION_ENGINES, create_background_subtractor, uses_hands
 from manifest_manager import ManifestManager
 
 
+def label_image_foreground(label_image, num_aois):
+    areas = np.bincount(label_image.ravel(), minlength=num_aois + 1)[1:]
+
+    # Foreground pixels of all AOIs are counted in a single pass over the label image
+    def aoi_foreground(frame_mask):
+        counts = np.bincount(label_image[frame_mask], minlength=num_aois + 1)[1:]
+        return counts / areas
+    return aoi_foreground
+
+
+def masks_foreground(masks):
+    areas = [aoi_mask.sum() for aoi_mask in masks.values()]
+
+    def aoi_foreground(frame_mask):
+        return [(frame_mask * aoi_mask).sum() / area for aoi_mask, area in zip(masks.values(), areas)]
+    return aoi_foreground
+
+
+def aoi_accounting(aoi_path, width, height, scale, cache_dir=None):
+    aoi_rasters = get_aoi_rasters(aoi_path, width, height, scale=scale, cache_dir=cache_dir)
+
+    if aoi_rasters['overlapping']:
+        logging.warning('Areas of interests overlap, rasterizing each area separately')
+        masks = get_masks(get_aois(aoi_path), width, height, scale=scale)
+        return list(masks.keys()), masks_foreground(masks)
+
+    return aoi_rasters['labels'], label_image_foreground(aoi_rasters['label_image'], len(aoi_rasters['labels']))
+
+
+def create_stages(stride=1, detect_every=1, redetect_threshold=.05, landmark_cache=None, model_asset_path='hand_landmarker_latest.task', engine='knn+hands', roi=None):
+    # The background history covers the same time span regardless of the stride
+    back_sub = create_background_subtractor(engine, history=3000 // stride)
+    stages = [partial(subtract_background, back_sub)]
+    hand_detector = None
+
+    if not uses_hands(engine):
+        stages.append(skip_hands)
+    else:
+        create_detector = partial(hand_detection.HandDetector, num_hands=10, model_asset_path=model_asset_path)
+        hand_detector = create_detector() if landmark_cache is None else hand_detection.CachedHandDetector(landmark_cache, create_detector)
+
+        if detect_every > 1:
+            hand_tracker = hand_detection.HandTracker(hand_detector, detect_every=detect_every, redetect_threshold=redetect_threshold)
+            stages.append(partial(track_hands, hand_tracker))
+        else:
+            stages.append(partial(detect_hands, hand_detector))
+
+    # Background subtraction and hand detection only run on the region of interest (x, y, width, height)
+    if roi is not None:
+        stages = [partial(crop_frame, roi), *stages, partial(uncrop_masks, roi)]
+    return stages, hand_detector
+
+
+def movement_row(frame, aoi_foreground):
+    frame_mask = frame['mask']
+    total_foreground = frame_mask.sum() / (frame_mask.shape[0]*frame_mask.shape[1])
+    return [frame['frame'], frame['msec']*1e-3, total_foreground, *aoi_foreground(frame_mask)]
+
+
+def interpolate_rows(df, skipped):
+    # Rows of frames skipped by the stride are linearly interpolated from the sampled frames
+    skipped = pd.DataFrame(skipped, columns=['frame', 'timestamp [sec]'])
+    skipped['timestamp [sec]'] = skipped['timestamp [sec]'] * 1e-3
+
+    for c in df.columns[2:]:
+        skipped[c] = np.interp(skipped['frame'], df['frame'], df[c])
+    return pd.concat([df, skipped]).sort_values('frame').reset_index(drop=True)
+
+
+def drain_skipped(skipped, writer, start_frame, last_frame=None):
+    # Skipped positions are collected by the reader thread, which may already be ahead of the processed frames
+    while skipped and (last_frame is None or skipped[0][0] <= last_frame):
+        position = skipped.pop(0)
+        if position[0] > start_frame:
+            writer.append(position)
+
+
+def finish_movement(partial_path, skipped_path, out_path, interpolate):
+    if interpolate:
+        df = pd.read_csv(partial_path, float_precision='round_trip')
+        skipped = list(pd.read_csv(skipped_path).itertuples(index=False, name=None))
+        if skipped:
+            df = interpolate_rows(df, skipped)
+        df.to_csv(out_path, index=False)
+        partial_path.unlink()
+    else:
+        partial_path.replace(out_path)
+    skipped_path.unlink(missing_ok=True)
+
+
+def process_shard(source_path, start_frame, end_frame, warmup_frames, dsize, aoi_args, stride=1, detect_args=None, queue_size=8, threads=True):
+    cap = open_video(source_path)
+    cap.set(cv.CAP_PROP_POS_FRAMES, max(0, start_frame - warmup_frames))
+    _, aoi_foreground = aoi_accounting(*aoi_args)
+    rows = []
+    skipped = []
+    shard_msec = set()
+
+    # Frames before the shard only warm up the background subtractor and hand tracking
+    stages, hand_detector = create_stages(stride, **(detect_args or {}))
+    frames = pipelined(read_frames(cap, dsize, end_frame=end_frame, stride=stride, skipped=skipped), stages, queue_size=queue_size, threads=threads)
+    with closing(frames):
+        for frame in frames:
+            if frame['frame'] > start_frame:
+                rows.append(movement_row(frame, aoi_foreground))
+                shard_msec.add(frame['msec'])
+
+    cap.release()
+
+    # New cache entries are merged and saved by the main process
+    new_points = {}
+    if isinstance(hand_detector, hand_detection.CachedHandDetector):
+        new_points = {msec: points for msec, points in hand_detector.new_points.items() if msec in shard_msec}
+    return rows, [s for s in skipped if s[0] > start_frame], new_points
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--manifest', type=Path, required=True)
@@ -23,8 +147,29 @@ if __name__ == '__main__':
     parser.add_argument('--show_output', action='store_true')
     parser.add_argument('--store_video', action='store_true')
     parser.add_argument('--downsampling_factor', type=float, default=1)
+    parser.add_argument('--queue_size', type=int, default=8)
+    parser.add_argument('--no_threads', action='store_true')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--warmup_sec', type=float, default=60.)
+    parser.add_argument('--stride', type=int, default=1)
+    parser.add_argument('--target_fps', type=float, required=False)
+    parser.add_argument('--interpolate', action='store_true')
+    parser.add_argument('--engine', choices=list(MOTION_ENGINES), default='knn+hands')
+    parser.add_argument('--detect_every', type=int, default=1)
+    parser.add_argument('--redetect_threshold', type=float, default=.05)
+    parser.add_argument('--no_landmark_cache', action='store_true')
+    parser.add_argument('--crop_to_aois', action='store_true')
+    parser.add_argument('--crop_padding', type=int, default=64)
+    parser.add_argument('--checkpoint_every', type=int, default=1000)
+    parser.add_argument('--resume', action='store_true')
     args = parser.parse_args()
 
+    if args.shards > 1 and (args.show_output or args.store_video):
+        parser.error('--show_output and --store_video are not supported with --shards')
+
+    if args.shards > 1 and args.resume:
+        parser.error('--resume is not supported with --shards')
+
     logging.getLogger().setLevel(logging.INFO)
 
     with ManifestManager(args.manifest) as man:
@@ -35,71 +180,144 @@ if __name__ == '__main__':
         frame_width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH))
         frame_height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
 
-        back_sub = cv.createBackgroundSubtractorKNN(history=3000, dist2Threshold=1000, detectShadows=False)
-        hand_detector = hand_detection.HandDetector(num_hands=10, model_asset_path='hand_landmarker_latest.task')
-
         if args.store_video:
             fourcc = cv.VideoWriter_fourcc(*'avc1')
             writer = cv.VideoWriter(str(args.out_dir / 'activity_knn.mp4'), fourcc=fourcc, fps=fps, frameSize=(frame_width, frame_height))
 
-        aois = get_aois(man.get_areas_of_interests()['path'])
-        masks = get_masks(aois, frame_width, frame_height)
-        masks = {label: cv.resize(mask, fx=args.downsampling_factor, fy=args.downsampling_factor, dsize=None) for label, mask in masks.items()}
+        stride = args.stride if args.target_fps is None else max(1, int(round(fps / args.target_fps)))
+
+        reduced_width, reduced_height = reduced_size(frame_width, frame_height, args.downsampling_factor)
+
+        video_path = man.get_video('workspace')['path']
+        aoi_args = (man.get_areas_of_interests()['path'], reduced_width, reduced_height, args.downsampling_factor, args.out_dir)
 
-        out = []
+        # Frames can be cropped to the padded bounding box of the AOI hull, the padding is given at video resolution
+        roi = None
+        if args.crop_to_aois:
+            roi = crop_box(get_aoi_rasters(*aoi_args[:3], scale=args.downsampling_factor, cache_dir=args.out_dir)['hull_mask'], int(args.crop_padding * args.downsampling_factor))
+            logging.info(f'Cropping frames to {roi[2]}x{roi[3]} at ({roi[0]}, {roi[1]}), {roi[2] * roi[3] / (reduced_width * reduced_height):.0%} of the pixels')
+
+        # Hand landmarks are detected once per video, model and resolution and reused by later runs
+        landmark_cache = None
+        if not args.no_landmark_cache and uses_hands(args.engine):
+            landmark_cache = hand_detection.landmark_cache_path(args.out_dir, video_path, 'hand_landmarker_latest.task', (reduced_height, reduced_width), roi=roi)
+
+        detect_args = {'detect_every': args.detect_every, 'redetect_threshold': args.redetect_threshold, 'landmark_cache': landmark_cache, 'engine': args.engine, 'roi': roi}
+
+        # Frames are read from a registered frame store if it matches the processing resolution
+        source_path = video_source(man, 'workspace', (reduced_width, reduced_height))
+        if source_path != video_path:
+            logging.info(f'Reading frames from frame store {source_path}')
+            cap.release()
+            cap = open_video(source_path)
+        labels, aoi_foreground = aoi_accounting(*aoi_args)
+
+        skipped = []
         out_path = args.out_dir / 'movement.csv'
+        columns = ['frame', 'timestamp [sec]', 'full'] + labels
+        warmup_frames = int(args.warmup_sec * fps)
+        start_time = time.perf_counter()
 
-        with tqdm(total=frame_count, unit='frames', disable=False) as t:
-            while True:
-                ret, img = cap.read()
-                if not ret:
-                    print('EOF')
-                    break
+        # Landmarks detected so far are also kept if the run is interrupted or fails
+        hand_detector = None
+        try:
+            if args.shards > 1:
+                # Each shard decodes and detects in its own process, starting a warm-up period before its first frame
+                bounds = np.linspace(0, frame_count, args.shards + 1).astype(int)
+                out = []
 
-                img = cv.resize(img, dsize=None, fx=args.downsampling_factor, fy=args.downsampling_factor, interpolation=cv.INTER_AREA)
-                pos_frame = int(cap.get(cv.CAP_PROP_POS_FRAMES))
-                pos_msec = int(cap.get(cv.CAP_PROP_POS_MSEC))
+                with ProcessPoolExecutor(max_workers=args.shards) as executor:
+                    futures = []
+                    for idx in range(args.shards):
+                        end_frame = None if idx == args.shards - 1 else bounds[idx + 1]
+                        futures.append(executor.submit(process_shard, source_path, bounds[idx], end_frame, warmup_frames, (reduced_width, reduced_height), aoi_args, stride=stride, detect_args=detect_args, queue_size=args.queue_size, threads=not args.no_threads))
 
-                detection_result = hand_detector.detect(img, pos_msec)
-                hand_mask = hand_detection.mask_from_hand_landmarks(detection_result, img.shape[:2])
-                fg_mask = back_sub.apply(img)
+                    hand_detector = None if landmark_cache is None else hand_detection.CachedHandDetector(landmark_cache, None)
+                    for idx, future in enumerate(futures):
+                        shard_rows, shard_skipped, new_points = future.result()
+                        out.extend(shard_rows)
+                        skipped.extend(shard_skipped)
+                        if hand_detector is not None:
+                            hand_detector.update(new_points)
+                        logging.info(f'Finished shard {idx + 1}/{args.shards}')
+                processed = len(out)
 
-                frame_mask = (fg_mask == 255) & hand_mask
-                out_mask = (255*frame_mask).astype(np.uint8)
-                
-                if args.store_video:
-                    out_frame = np.stack([out_mask, out_mask, out_mask], axis=2)
-                    out_frame = cv.resize(out_frame, dsize=(frame_width, frame_height), interpolation=cv.INTER_AREA)
-                    writer.write(out_frame)
+                df = pd.DataFrame(out, columns=columns)
+                if args.interpolate and skipped:
+                    df = interpolate_rows(df, skipped)
+                df.to_csv(out_path, index=False)
+            else:
+                # Rows are streamed to a partial file, a checkpoint records how far it is complete
+                partial_path = args.out_dir / 'movement.partial.csv'
+                skipped_path = args.out_dir / 'movement.skipped.csv'
+                config = {'source': str(source_path), 'aois': file_digest(aoi_args[0]), 'width': reduced_width, 'height': reduced_height, 'stride': stride, 'engine': args.engine, 'roi': roi, 'detect_every': args.detect_every, 'redetect_threshold': args.redetect_threshold}
+                checkpoint = Checkpoint(args.out_dir / 'movement.checkpoint.json', config, outputs=[partial_path, skipped_path])
 
-                total_foreground = frame_mask.sum() / (img.shape[0]*img.shape[1])
+                state = checkpoint.load() if args.resume else None
+                if state is None:
+                    start_frame = 0
+                    rows = CsvWriter(partial_path, columns)
+                    skipped_rows = CsvWriter(skipped_path, ['frame', 'msec'])
+                else:
+                    # The interrupted run is continued after a warm-up period, like a shard
+                    start_frame = state['frame']
+                    logging.info(f'Resuming after frame {start_frame}')
+                    rows = CsvWriter(partial_path, columns, resume_bytes=state['rows_bytes'])
+                    skipped_rows = CsvWriter(skipped_path, ['frame', 'msec'], resume_bytes=state['skipped_bytes'])
+                    cap.set(cv.CAP_PROP_POS_FRAMES, max(0, start_frame - warmup_frames))
 
-                if args.show_output:
-                    cv.imshow('Hand Landmarks', hand_detection.draw_landmarks_on_image(img, detection_result))    
-                    cv.imshow('Mask', out_mask)    
-                    cv.imshow('frame', img)
+                stages, hand_detector = create_stages(stride, **detect_args)
+                frames = pipelined(read_frames(cap, (reduced_width, reduced_height), stride=stride, skipped=skipped), stages, queue_size=args.queue_size, threads=not args.no_threads)
 
-                out_row = [pos_frame, pos_msec*1e-3, total_foreground]
+                processed = 0
+                with tqdm(total=frame_count, initial=start_frame, unit='frames', disable=False) as t, closing(frames):
+                    for frame in frames:
+                        if frame['frame'] <= start_frame:
+                            continue
 
-                for label, aoi_mask in masks.items():
-                    fg_mask_aoi = frame_mask * aoi_mask
-                    aoi_foreground = fg_mask_aoi.sum() / aoi_mask.sum()
-                    out_row.append(aoi_foreground)
+                        img = frame['img']
+                        out_mask = (255*frame['mask']).astype(np.uint8)
 
-                out.append(out_row)
+                        if args.store_video:
+                            out_frame = np.stack([out_mask, out_mask, out_mask], axis=2)
+                            out_frame = cv.resize(out_frame, dsize=(frame_width, frame_height), interpolation=cv.INTER_AREA)
+                            writer.write(out_frame)
 
-                if args.show_output and (0xff & cv.waitKey(1)) == ord('q'):
-                    break
+                        if args.show_output:
+                            if frame['detection'] is not None:
+                                cv.imshow('Hand Landmarks', hand_detection.draw_landmarks_on_image(img, frame['detection']))
+                            cv.imshow('Hand Mask', (255*frame['hand_mask']).astype(np.uint8))
+                            cv.imshow('Mask', out_mask)    
+                            cv.imshow('frame', img)
 
-                t.update()
+                        rows.append(movement_row(frame, aoi_foreground))
+                        processed += 1
 
-            columns = ['frame', 'timestamp [sec]', 'full'] + list(aois.keys())
-            df = pd.DataFrame(out, columns=columns)
-            df.to_csv(out_path, index=False)
+                        if processed % args.checkpoint_every == 0:
+                            drain_skipped(skipped, skipped_rows, start_frame, frame['frame'])
+                            checkpoint.save({'frame': frame['frame'], 'rows_bytes': rows.flush(), 'skipped_bytes': skipped_rows.flush()})
 
-            man.register_multi_time('movement', {'path': str(out_path), 'categories': 'areas_of_interests'})
-            logging.info('Registered "multi_time/movement" as an global artifact')
-            
-            cap.release()
-            if args.store_video:
-                writer.release()
\ No newline at end of file
+                        if args.show_output and (0xff & cv.waitKey(1)) == ord('q'):
+                            break
+
+                        t.update(frame['frame'] - t.n)
+
+                rows.flush()
+                drain_skipped(skipped, skipped_rows, start_frame)
+                skipped_rows.flush()
+                finish_movement(partial_path, skipped_path, out_path, args.interpolate)
+                checkpoint.remove()
+        finally:
+            if isinstance(hand_detector, hand_detection.CachedHandDetector):
+                logging.info(f'Adding hand landmarks of {len(hand_detector.new_points)} frames to {hand_detector.cache_path}')
+                hand_detector.save()
+
+        elapsed_sec = time.perf_counter() - start_time
+        logging.info(f'Processed {processed} frames in {elapsed_sec:.1f} sec ({processed / elapsed_sec:.1f} frames per sec)')
+
+        man.register_multi_time('movement', {'path': str(out_path), 'categories': 'areas_of_interests'})
+        logging.info('Registered "multi_time/movement" as an global artifact')
+        
+        cap.release()
+        if args.store_video:
+            writer.release()
@@ -0,0 +1,52 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import argparse
+import logging
+import subprocess
+
+from pathlib import Path
+from manifest_manager import ManifestManager
+
+
+def transcode_proxy(ffmpeg, video_path, out_path, height, keyframe_interval_sec, crf):
+    # Keyframes at a fixed interval make seeking cheap, videos smaller than the proxy height are not upscaled
+    cmd = [
+        ffmpeg, '-y', '-loglevel', 'error', '-i', str(video_path),
+        '-vf', f'scale=-2:min({height}\\,ih)',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(crf), '-pix_fmt', 'yuv420p',
+        '-force_key_frames', f'expr:gte(t,n_forced*{keyframe_interval_sec})', '-sc_threshold', '0',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-movflags', '+faststart',
+        str(out_path),
+    ]
+    subprocess.run(cmd, check=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', type=Path, required=True)
+    parser.add_argument('--out_dir', type=Path, required=True)
+    parser.add_argument('--videos', type=str, nargs='+', required=False)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--keyframe_interval_sec', type=float, default=.5)
+    parser.add_argument('--crf', type=int, default=26)
+    parser.add_argument('--ffmpeg', type=str, default='ffmpeg')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+
+    with ManifestManager(args.manifest) as man:
+        names = args.videos if args.videos else list(man.get_source('videos').keys())
+        args.out_dir.mkdir(exist_ok=True, parents=True)
+
+        for name in names:
+            video_path = man.get_video(name)['path']
+            out_path = args.out_dir / f'{name}_proxy_{args.height}p.mp4'
+
+            logging.info(f'Transcoding {video_path} to {out_path}')
+            transcode_proxy(args.ffmpeg, video_path, out_path, args.height, args.keyframe_interval_sec, args.crf)
+
+            man.register_proxy_video(name, {'path': str(out_path), 'height': args.height, 'keyframe_interval_sec': args.keyframe_interval_sec})
+            logging.info(f'Registered "proxy_video/{name}" as an global artifact')
@@ -0,0 +1,201 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import cv2 as cv
+import pandas as pd
+import numpy as np
+import argparse
+import hand_detection
+import logging
+import time
+
+from contextlib import closing
+from pathlib import Path
+from tqdm import tqdm
+from pipeline import pipelined, read_frames
+from utils import SMOOTHING_METHODS, HeatmapStackWriter, smooth, get_aoi_rasters, crop_box, file_digest
+from frame_store import open_video, video_source, reduced_size
+from register_movement import aoi_accounting, create_stages, movement_row, drain_skipped, finish_movement
+from checkpoint import Checkpoint, CsvWriter
+from motion import MOTION_ENGINES, uses_hands
+from manifest_manager import ManifestManager
+
+
+class HeatmapWindows:
+    def __init__(self, writer, start_timestamps, hull_mask, size, kernel_size, smoothing='exact', window=0) -> None:
+        self.writer = writer
+        self.start_timestamps = start_timestamps
+        self.hull_mask = hull_mask
+        self.size = size
+        self.kernel_size = kernel_size
+        self.smoothing = smoothing
+        self.window = window
+        self.accu = np.zeros(hull_mask.shape, dtype=np.float32)
+        self.count = 0
+
+    def advance(self, timestamp):
+        # Every frame belongs to the last window starting at or before its timestamp. Returns whether windows were finished.
+        window = min(np.searchsorted(self.start_timestamps, timestamp, side='right') - 1, len(self.start_timestamps))
+        finished = self.window < window
+        while self.window < window:
+            self.flush()
+        return finished
+
+    def add(self, frame):
+        self.advance(frame['msec'] * 1e-3)
+        if self.window < len(self.start_timestamps):
+            self.accu += frame['mask'] & self.hull_mask
+            self.count += 1
+
+    def flush(self):
+        # Masks are averaged at the processing resolution and upsampled once per window
+        activity = self.accu / max(self.count, 1)
+        activity = cv.resize(activity, dsize=self.size, interpolation=cv.INTER_AREA)
+
+        self.writer.write(self.window, smooth(activity, self.kernel_size, method=self.smoothing).astype(np.float16))
+
+        self.window += 1
+        self.accu[:] = 0
+        self.count = 0
+
+    def close(self):
+        while self.window < len(self.start_timestamps):
+            self.flush()
+        self.writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', type=Path, required=True)
+    parser.add_argument('--out_dir', type=Path, required=True)
+    parser.add_argument('--downsampling_factor', type=float, default=.5)
+    parser.add_argument('--delta_step_sec', type=float, default=30.)
+    parser.add_argument('--kernel_size', type=int, default=211)
+    parser.add_argument('--smoothing', choices=list(SMOOTHING_METHODS), default='exact')
+    parser.add_argument('--pyramid_levels', type=int, default=3)
+    parser.add_argument('--compress', action='store_true')
+    parser.add_argument('--queue_size', type=int, default=8)
+    parser.add_argument('--no_threads', action='store_true')
+    parser.add_argument('--stride', type=int, default=1)
+    parser.add_argument('--interpolate', action='store_true')
+    parser.add_argument('--engine', choices=list(MOTION_ENGINES), default='knn+hands')
+    parser.add_argument('--detect_every', type=int, default=1)
+    parser.add_argument('--redetect_threshold', type=float, default=.05)
+    parser.add_argument('--no_landmark_cache', action='store_true')
+    parser.add_argument('--crop_to_aois', action='store_true')
+    parser.add_argument('--crop_padding', type=int, default=64)
+    parser.add_argument('--warmup_sec', type=float, default=60.)
+    parser.add_argument('--resume', action='store_true')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+
+    with ManifestManager(args.manifest) as man:
+        root_dir = args.out_dir
+
+        video_path = man.get_video('workspace')['path']
+        aoi_path = man.get_areas_of_interests()['path']
+
+        cap = cv.VideoCapture(video_path)
+        fps = cap.get(cv.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+        frame_width = int(cap.get(cv.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+
+        reduced_width, reduced_height = reduced_size(frame_width, frame_height, args.downsampling_factor)
+
+        labels, aoi_foreground = aoi_accounting(aoi_path, reduced_width, reduced_height, args.downsampling_factor, root_dir)
+        hull_mask = get_aoi_rasters(aoi_path, reduced_width, reduced_height, scale=args.downsampling_factor, cache_dir=root_dir)['hull_mask']
+
+        roi = None
+        if args.crop_to_aois:
+            roi = crop_box(hull_mask, int(args.crop_padding * args.downsampling_factor))
+            logging.info(f'Cropping frames to {roi[2]}x{roi[3]} at ({roi[0]}, {roi[1]}), {roi[2] * roi[3] / (reduced_width * reduced_height):.0%} of the pixels')
+
+        landmark_cache = None
+        if not args.no_landmark_cache and uses_hands(args.engine):
+            landmark_cache = hand_detection.landmark_cache_path(root_dir, video_path, 'hand_landmarker_latest.task', (reduced_height, reduced_width), roi=roi)
+
+        dur_sec = int(frame_count / fps)
+        start_timestamps = np.arange(0, dur_sec, args.delta_step_sec)
+        end_timestamps = start_timestamps + args.delta_step_sec - 1e-1
+        # Checkpoints are saved whenever heatmap windows are finished, together with the movement rows up to that point
+        partial_path = root_dir / 'movement.partial.csv'
+        skipped_path = root_dir / 'movement.skipped.csv'
+        columns = ['frame', 'timestamp [sec]', 'full'] + labels
+        config = {'video': video_path, 'aois': file_digest(aoi_path), 'width': reduced_width, 'height': reduced_height, 'stride': args.stride, 'engine': args.engine, 'roi': roi, 'delta_step_sec': args.delta_step_sec, 'kernel_size': args.kernel_size, 'smoothing': args.smoothing, 'pyramid_levels': args.pyramid_levels, 'compress': args.compress, 'detect_every': args.detect_every, 'redetect_threshold': args.redetect_threshold}
+        checkpoint = Checkpoint(root_dir / 'features.checkpoint.json', config, outputs=[partial_path, skipped_path] + HeatmapStackWriter.level_paths(root_dir / 'move.stack', args.pyramid_levels))
+        state = checkpoint.load() if args.resume else None
+
+        source_path = video_source(man, 'workspace', (reduced_width, reduced_height))
+        cap = open_video(source_path)
+
+        if state is None:
+            start_frame, first_window = 0, 0
+            rows = CsvWriter(partial_path, columns)
+            skipped_rows = CsvWriter(skipped_path, ['frame', 'msec'])
+        else:
+            # Frames within the warm-up period before the last checkpoint only warm up background subtraction and tracking
+            start_frame, first_window = state['frame'], state['window']
+            logging.info(f'Resuming after frame {start_frame} at window {first_window}/{len(start_timestamps)}')
+            rows = CsvWriter(partial_path, columns, resume_bytes=state['rows_bytes'])
+            skipped_rows = CsvWriter(skipped_path, ['frame', 'msec'], resume_bytes=state['skipped_bytes'])
+            cap.set(cv.CAP_PROP_POS_FRAMES, max(0, start_frame - int(args.warmup_sec * fps)))
+
+        writer = HeatmapStackWriter(root_dir / 'move.stack', len(start_timestamps), (frame_height, frame_width), levels=args.pyramid_levels, compress=args.compress, resume=state is not None)
+        heatmaps = HeatmapWindows(writer, start_timestamps, hull_mask, (frame_width, frame_height), args.kernel_size, smoothing=args.smoothing, window=first_window)
+
+        # Movement signal and movement heatmaps are computed from the same per-frame masks
+        skipped = []
+        processed = 0
+        last_frame = start_frame
+        start_time = time.perf_counter()
+
+        stages, hand_detector = create_stages(args.stride, detect_every=args.detect_every, redetect_threshold=args.redetect_threshold, landmark_cache=landmark_cache, engine=args.engine, roi=roi)
+        frames = pipelined(read_frames(cap, (reduced_width, reduced_height), stride=args.stride, skipped=skipped), stages, queue_size=args.queue_size, threads=not args.no_threads)
+
+        # Landmarks detected so far are also kept if the run is interrupted or fails
+        try:
+            with tqdm(total=frame_count, initial=start_frame, unit='frames') as t, closing(frames):
+                for frame in frames:
+                    if frame['frame'] <= start_frame:
+                        continue
+
+                    if heatmaps.advance(frame['msec'] * 1e-3):
+                        writer.flush()
+                        drain_skipped(skipped, skipped_rows, start_frame, last_frame)
+                        checkpoint.save({'frame': last_frame, 'window': heatmaps.window, 'rows_bytes': rows.flush(), 'skipped_bytes': skipped_rows.flush()})
+
+                    rows.append(movement_row(frame, aoi_foreground))
+                    heatmaps.add(frame)
+                    processed += 1
+                    last_frame = frame['frame']
+                    t.update(frame['frame'] - t.n)
+        finally:
+            if isinstance(hand_detector, hand_detection.CachedHandDetector):
+                logging.info(f'Adding hand landmarks of {len(hand_detector.new_points)} frames to {hand_detector.cache_path}')
+                hand_detector.save()
+        heatmaps.close()
+        cap.release()
+
+        elapsed_sec = time.perf_counter() - start_time
+        logging.info(f'Processed {processed} frames in {elapsed_sec:.1f} sec ({processed / elapsed_sec:.1f} frames per sec)')
+
+        rows.flush()
+        drain_skipped(skipped, skipped_rows, start_frame)
+        skipped_rows.flush()
+        finish_movement(partial_path, skipped_path, root_dir / 'movement.csv', args.interpolate)
+        checkpoint.remove()
+
+        df = pd.DataFrame(data=zip(start_timestamps, end_timestamps), columns=('start timestamp [sec]', 'end timestamp [sec]'))
+        df.insert(0, 'filename', 'move.stack')
+        df.insert(1, 'index', np.arange(len(df.index)))
+        df.to_csv(root_dir / 'move.csv', index=False)
+
+        man.register_multi_time('movement', {'path': str(root_dir / 'movement.csv'), 'categories': 'areas_of_interests'})
+        logging.info('Registered "multi_time/movement" as an global artifact')
+
+        man.register_video_overlay('movement', {'path': str(root_dir / 'move.csv')})
+        logging.info('Registered "video_overlay/movement" as an global artifact')
@@ -1,11 +1,14 @@
 import cv2 as cv
+import hashlib
 import json
 import numpy as np
 import shapely
 
 import matplotlib.cm as cm
-from tqdm import tqdm
 from shapely.ops import unary_union
+from scipy.ndimage import correlate1d, uniform_filter1d
+from scipy.signal import fftconvolve
+from pathlib import Path
 
 
 def gaussian_kernel(l):
@@ -23,6 +26,119 @@ def gaussian_kernel_1d(l):
     return kernel / np.sum(kernel)
     
 
+def smooth_exact(img, kernel_size, mode='reflect'):
+    kernel_1d = gaussian_kernel_1d(kernel_size)
+    temp = correlate1d(img, weights=kernel_1d, axis=0, mode=mode)
+    return correlate1d(temp, weights=kernel_1d, axis=1, mode=mode)
+
+
+def box_sizes(sigma, passes):
+    # Widths of successive box filters whose combined variance approximates a Gaussian with the given sigma
+    ideal = np.sqrt(12 * sigma**2 / passes + 1)
+    lower = int(np.floor(ideal))
+    lower = lower - 1 if lower % 2 == 0 else lower
+    num_lower = round((12 * sigma**2 - passes * lower**2 - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    return [lower if idx < num_lower else lower + 2 for idx in range(passes)]
+
+
+def smooth_box(img, kernel_size, mode='reflect', passes=3):
+    sizes = box_sizes((kernel_size - 1) / 8., passes)
+
+    # With zero padding, mass leaving the image in one pass has to be able to return in the next
+    pad = sum(size // 2 for size in sizes) if mode == 'constant' else 0
+    img = np.pad(img, pad)
+
+    for size in sizes:
+        img = uniform_filter1d(img, size, axis=0, mode=mode)
+        img = uniform_filter1d(img, size, axis=1, mode=mode)
+    return img[pad: img.shape[0] - pad, pad: img.shape[1] - pad]
+
+
+def smooth_pyramid(img, kernel_size, mode='reflect', min_sigma=8.):
+    # Blurs a downsampled image with a proportionally smaller kernel and upsamples the result
+    sigma = (kernel_size - 1) / 8.
+    factor = max(1, int(sigma / min_sigma))
+    if factor == 1:
+        return smooth_exact(img, kernel_size, mode=mode)
+
+    height, width = img.shape
+    small = cv.resize(img, dsize=(-(-width // factor), -(-height // factor)), interpolation=cv.INTER_AREA)
+
+    # Area downsampling already contributes a variance of factor^2 / 12 pixels
+    small_sigma = np.sqrt(max(sigma**2 - factor**2 / 12, 0)) / factor
+    small = smooth_exact(small, 2 * int(np.ceil(4 * small_sigma)) + 1, mode=mode)
+    return cv.resize(small, dsize=(width, height), interpolation=cv.INTER_LINEAR)
+
+
+def smooth_fft(img, kernel_size, mode='reflect'):
+    kernel_1d = gaussian_kernel_1d(kernel_size)
+    pad = kernel_size // 2
+
+    # numpy calls the reflect mode of scipy.ndimage symmetric
+    img = np.pad(img, pad, mode='symmetric' if mode == 'reflect' else mode)
+    img = fftconvolve(img, kernel_1d[:, None], mode='valid', axes=0)
+    return fftconvolve(img, kernel_1d[None, :], mode='valid', axes=1)
+
+
+SMOOTHING_METHODS = {
+    'exact': smooth_exact,
+    'box': smooth_box,
+    'pyramid': smooth_pyramid,
+    'fft': smooth_fft,
+}
+
+
+def smooth(img, kernel_size, method='exact', mode='reflect'):
+    return SMOOTHING_METHODS[method](img, kernel_size, mode=mode)
+
+
+class HeatmapStackWriter:
+    # Heatmaps of all windows are stored as one time x height x width float16 array per pyramid level in
+    # <path>/level<N>.npy, level N having 1/2^N of the resolution. With compress, the levels are moved into
+    # <path>/levels.npz when the writer is closed after all windows were written. Every window of every level is
+    # compressed separately as level<N>_<window>, so readers only decompress the windows they need.
+    # With resume, the arrays of an interrupted run are reopened and written windows are kept.
+    def __init__(self, path, num_windows, size, levels=3, compress=False, resume=False) -> None:
+        self.path = Path(path)
+        self.path.mkdir(exist_ok=True, parents=True)
+        self.compress = compress
+        self.sizes = [size]
+
+        for _ in range(1, levels):
+            height, width = self.sizes[-1]
+            self.sizes.append((-(-height // 2), -(-width // 2)))
+
+        mode = 'r+' if resume else 'w+'
+        self.levels = [np.lib.format.open_memmap(level_path, mode=mode, dtype=np.float16, shape=(num_windows, *level_size)) for level_path, level_size in zip(self.level_paths(self.path, levels), self.sizes)]
+
+    @staticmethod
+    def level_paths(path, levels):
+        return [Path(path) / f'level{idx}.npy' for idx in range(levels)]
+
+    def write(self, idx, heatmap):
+        heatmap = heatmap.astype(np.float32)
+        for level, (height, width) in zip(self.levels, self.sizes):
+            if heatmap.shape != (height, width):
+                heatmap = cv.resize(heatmap, dsize=(width, height), interpolation=cv.INTER_AREA)
+            level[idx] = heatmap
+
+    def flush(self):
+        for level in self.levels:
+            level.flush()
+
+    def close(self, complete=True):
+        self.flush()
+
+        # An incomplete stack stays uncompressed so that it can be resumed
+        if self.compress and complete:
+            np.savez_compressed(self.path / 'levels.npz', **{f'level{idx}_{window:05d}': level[window] for idx, level in enumerate(self.levels) for window in range(len(level))})
+            self.levels = []
+            for level_path in self.level_paths(self.path, len(self.sizes)):
+                level_path.unlink()
+        elif (self.path / 'levels.npz').is_file():
+            (self.path / 'levels.npz').unlink()
+
+
 def create_heatmap_img(heatmap, colormap=cm.get_cmap('plasma', 9)):
     heatmap = heatmap / heatmap.max()
     heatmap = np.clip(heatmap, 0, 1)
@@ -52,28 +168,86 @@ def get_aois(aoi_config_path):
         return shapes_geom
 
 
-# TODO This is rather slow since we iterate over all pixels in polygons bounding box
-def get_masks(aois, width, height):
-    masks = {}
-    for label, shape in tqdm(aois.items()):
-        minx, miny, maxx, maxy = shape.bounds
-        masks[label] = np.zeros((height, width), dtype=float)
+def rasterize_polygon(polygon, width, height, scale=1.):
+    mask = np.zeros((height, width), dtype=np.uint8)
+    # Vertices in fixed point with 4 fractional bits to keep subpixel precision
+    points = np.round(np.asarray(polygon.exterior.coords) * scale * 16).astype(np.int32)
+    cv.fillPoly(mask, [points], 1, lineType=cv.LINE_8, shift=4)
+    return mask.astype(bool)
 
-        for x in range(int(minx), int(maxx)):
-            for y in range(int(miny), int(maxy)):
-                masks[label][y, x] = aois[label].contains(shapely.Point(x, y))
-    return masks
 
+def get_masks(aois, width, height, scale=1.):
+    return {label: rasterize_polygon(shape, width, height, scale).astype(float) for label, shape in aois.items()}
 
-def get_merged_aois_masks(aois, width, height):
-    mask = np.zeros((height, width), dtype=bool)
+
+def get_merged_aois_masks(aois, width, height, scale=1.):
     merged_polygon = unary_union(list(aois.values()))
     convex_hull = merged_polygon.convex_hull
-
-    minx, miny, maxx, maxy = convex_hull.bounds
-
-    for x in range(int(minx), int(maxx)):
-        for y in range(int(miny), int(maxy)):
-            mask[y, x] = convex_hull.contains(shapely.Point(x, y))
-    return mask.astype(float)
-
+    return rasterize_polygon(convex_hull, width, height, scale).astype(float)
+
+
+def get_label_image(aois, width, height, scale=1.):
+    label_image = np.zeros((height, width), dtype=np.int16)
+    coverage = np.zeros((height, width), dtype=np.int16)
+
+    # Painted in reverse order so the first AOI in labelme order wins where AOIs overlap
+    for idx, shape in reversed(list(enumerate(aois.values()))):
+        mask = rasterize_polygon(shape, width, height, scale)
+        label_image[mask] = idx + 1
+        coverage += mask
+    return label_image, bool((coverage > 1).any())
+
+
+def file_digest(path, sample_bytes=None):
+    # Large files such as videos are identified by their size and their first and last bytes only
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        if sample_bytes is None:
+            sha1.update(f.read())
+        else:
+            size = f.seek(0, 2)
+            sha1.update(str(size).encode())
+            f.seek(0)
+            sha1.update(f.read(sample_bytes))
+            f.seek(max(0, size - sample_bytes))
+            sha1.update(f.read(sample_bytes))
+    return sha1.hexdigest()[:16]
+
+
+def get_aoi_rasters(aoi_config_path, width, height, scale=1., cache_dir=None):
+    digest = file_digest(aoi_config_path)
+
+    cache_path = None if cache_dir is None else Path(cache_dir) / f'aois_{digest}_{width}x{height}_{scale:g}.npz'
+    if cache_path is not None and cache_path.is_file():
+        with np.load(cache_path) as cached:
+            return {
+                'labels': [str(label) for label in cached['labels']],
+                'label_image': cached['label_image'],
+                'overlapping': bool(cached['overlapping']),
+                'hull_mask': cached['hull_mask'],
+            }
+
+    aois = get_aois(aoi_config_path)
+    label_image, overlapping = get_label_image(aois, width, height, scale)
+    rasters = {
+        'labels': list(aois.keys()),
+        'label_image': label_image,
+        'overlapping': overlapping,
+        'hull_mask': get_merged_aois_masks(aois, width, height, scale).astype(bool),
+    }
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(exist_ok=True, parents=True)
+        np.savez_compressed(cache_path, **rasters)
+    return rasters
+
+
+def crop_box(mask, padding=0):
+    # Bounding box (x, y, width, height) of the nonzero pixels of mask, padded and clipped to the image
+    x, y, w, h = cv.boundingRect(mask.astype(np.uint8))
+    if w == 0 or h == 0:
+        return 0, 0, mask.shape[1], mask.shape[0]
+
+    x0, y0 = max(x - padding, 0), max(y - padding, 0)
+    x1, y1 = min(x + w + padding, mask.shape[1]), min(y + h + padding, mask.shape[0])
+    return x0, y0, x1 - x0, y1 - y0